@@ -6,6 +6,7 @@ import multiprocessing
 import concurrent.futures
 import subprocess
 from pathlib import Path
+from histfeas.catalog import updatecatalog
 
 rdir = "out"
 ini = "../in/2cam_split.ini"
@@ -29,6 +30,11 @@ def runhist(cx1):
 def main():
     with concurrent.futures.ProcessPoolExecutor(max_workers=Ncpu) as executor:
         executor.map(runhist, cam1)
+    #%% sweep summary
+    cat = updatecatalog(rdir)
+    print("cam1 x [km]  x0 estimate [km]  E0 estimate [eV]")
+    for j in cat["camx1"].argsort():
+        print(f"{cat['camx1'][j]:11.1f}  {cat['gx0'][j]:16.2f}  {cat['gE0'][j]:16.0f}")
 
 
 if __name__ == "__main__":
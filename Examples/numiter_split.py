@@ -6,8 +6,10 @@ import multiprocessing
 import concurrent.futures
 import subprocess
 from pathlib import Path
+from histfeas.catalog import updatecatalog
 
 load = False
+replot = False  # also re-make the figures of each run (slow: one FigureMaker.py --load per run)
 
 rdir = "out"
 ini = "../in/2cam_split.ini"
@@ -74,8 +76,15 @@ def main(load):
         print("SKIPPING COMPUTATIONS")
     #%% analyze
     # odirs = [str(rdir / outpat.format(n)) for n in Niter]
-    for nit in Niter:
-        loadhist(nit)
+    cat = updatecatalog(rdir)
+    print("iterations  E0 estimate [eV]  residual")
+    for j in cat["niter"].argsort():
+        nit, E0, res = cat["niter"][j], cat["gE0"][j], cat["residual"][j]
+        print(f"{nit:10.0f}  {E0:16.0f}  {res:.3e}")
+
+    if replot:
+        for nit in Niter:
+            loadhist(nit)
 
 
 if __name__ == "__main__":
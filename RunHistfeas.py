@@ -4,14 +4,7 @@ Example command line interfacer for HIST feasibility
 Michael Hirsch
 """
 
-import matplotlib as mpl
-from matplotlib.pyplot import show
-
-#
 from histfeas import userinput
-from histfeas.main_hist import doSim
-
-print("matplotlib backend:", mpl.get_backend(), " version", mpl.__version__)
 
 if __name__ == "__main__":
     import signal
@@ -42,6 +35,12 @@ if __name__ == "__main__":
     #    p = p.parse_args()
 
     P = userinput()
+
+    from histfeas.main_hist import doSim  # after userinput() picked the matplotlib backend
+
     doSim(P)
 
-    show()
+    if "show" in P["makeplot"]:
+        from matplotlib.pyplot import show
+
+        show()
@@ -3,8 +3,19 @@ import h5py
 
 # from numba import jit
 # from numbapro import vectorize
-from numpy import empty, ones, ravel_multi_index, hypot, zeros, in1d, array
-from scipy.sparse import dok_matrix, issparse
+from numpy import (
+    empty,
+    ones,
+    ravel_multi_index,
+    hypot,
+    zeros,
+    in1d,
+    array,
+    diff,
+    arange,
+    flatnonzero,
+)
+from scipy.sparse import dok_matrix, issparse, csr_matrix
 from shutil import copy2, SameFileError
 
 # local
@@ -85,9 +96,9 @@ def EllLineLength(Fwd, xFOVpixelEnds, zFOVpixelEnds, allCamXkm, allCamZkm, Np, s
         makeplot,
         (None,) * 6,
     )
-    #%% to CSC sparse, if built as DOK sparse
+    #%% to CSR sparse, if built as DOK sparse
     if issparse(L):
-        L = L.tocsc()
+        L = L.tocsr()
     return L
 
 
@@ -122,7 +133,7 @@ def goCalcEll(maxNell, nCam, Np, sz, sx, xpc, zpc, xFOVpixelEnds, zFOVpixelEnds,
     )  # numba
 
     if SPARSE:
-        return L.tocsc()
+        return L.tocsr()
     else:
         return L
 
@@ -187,11 +198,17 @@ def loopEll(
 
 def doSaveEll(L, Fwd, sim, xFOVpixelEnds, zFOVpixelEnds):
     print("writing {}".format(sim.FwdLfn))
-    if issparse(L):
-        L = L.todense()
+    # always double precision: the Ell file is shared by runs of any dtype, which cast on load
+    L = csr_matrix(L, dtype=float)
     with h5py.File(str(sim.FwdLfn), "w", libver="latest") as fid:
-        h5L = fid.create_dataset("/L", data=L, compression="gzip")
+        # compressed sparse row, so a camera's rows are one contiguous indptr slice
+        h5L = fid.create_group("/L")
         h5L.attrs["Units"] = "kilometers"
+        h5L.attrs["format"] = "csr"
+        h5L.attrs["shape"] = L.shape
+        h5L.create_dataset("data", data=L.data, compression="gzip")
+        h5L.create_dataset("indices", data=L.indices, compression="gzip")
+        h5L.create_dataset("indptr", data=L.indptr, compression="gzip")
         h5Fwdx = fid.create_dataset("/Fwd/x", data=Fwd["x"])
         h5Fwdx.attrs["Units"] = "kilometers"
         h5Fwdz = fid.create_dataset("/Fwd/z", data=Fwd["z"])
@@ -206,6 +223,15 @@ def doSaveEll(L, Fwd, sim, xFOVpixelEnds, zFOVpixelEnds):
         h5ObsxFPE.attrs["Units"] = "kilometers"
         h5ObszFPE = fid.create_dataset("/Obs/zFOVpixelEnds", data=zFOVpixelEnds)
         h5ObszFPE.attrs["Units"] = "kilometers"
+        # pixels whose ray intersects the grid, the nonempty rows of L
+        hit = hitpixels(L)
+        fid.create_dataset("/Obs/hitpix", data=hit)
+        # first row of L of each camera, and the number of rows
+        offset = arange(0, L.shape[0] + 1, sim.ncutpix)
+        fid.create_dataset("/Obs/camrowoffset", data=offset)
+        # per camera: indices of its hit pixels, so reloading results needn't read L
+        for i, (a, b) in enumerate(zip(offset[:-1], offset[1:])):
+            fid.create_dataset(f"/Obs/hitind/{i}", data=flatnonzero(hit[a:b]))
     #        h5xCam = fid.create_dataset('/Obs/xCam',data=sim.allCamXkm); h5xCam.attrs['Units'] = 'kilometers'
     #        h5zCam = fid.create_dataset('/Obs/zCam',data=sim.allCamZkm); h5zCam.attrs['Units'] = 'kilometers'
     try:
@@ -214,6 +240,13 @@ def doSaveEll(L, Fwd, sim, xFOVpixelEnds, zFOVpixelEnds):
         logging.warning("did not copy ell file from {} to {}".format(sim.FwdLfn, sim.cal1dpath))
 
 
+def hitpixels(L):
+    """
+    boolean mask of the rows of L (camera pixels) whose ray crosses any grid voxel
+    """
+    return diff(csr_matrix(L).indptr) > 0
+
+
 def plotEll(
     nCam,
     xFOVpixelEnds,
@@ -1,15 +1,18 @@
 #!/usr/bin/env python
 import logging
-from numpy import absolute, asfortranarray, diff, ones, inf, empty_like, isfinite
+from numpy import absolute, asfortranarray, diff, ones, inf, empty, empty_like, isfinite
+from numpy import asarray, arange, searchsorted, zeros, full, float32
 from scipy.optimize import minimize
+from scipy.sparse import csr_matrix, identity, kron
 from scipy.interpolate import interp1d
 from numpy.linalg import norm
 from time import time
 from warnings import warn
 
 #
-from .transcararc import getColumnVER
-from .plotsnew import getx0E0
+from .transcararc import getColumnVER, energygroups
+from .observeVolume import observedvoxels
+from .peakest import peakx0E0
 
 
 def FitVERopt(L, bn, Phi0, MpDict, sim, cam, Fwd, tInd, P):
@@ -27,27 +30,10 @@ def FitVERopt(L, bn, Phi0, MpDict, sim, cam, Fwd, tInd, P):
     Phifit = {"x": None, "EK": EK, "EKpcolor": EKpcolor}  # in case optim not run - don't remove
     minverbose = bool(P["verbose"])
     #%% scaling brightness
-    """
-    We could repeatedly downscale simulted brightness in loop, but that consumes a lot of CPU.
-    It is equivalent to temporarily upscale observed brightness once before minimization
-    Then downscale once after minimization
-    """
-    bscale = [C.dn2intens for C in cam if C.usecam]
-    cInd = [C.ind for C in cam if C.usecam]
-    bnu = empty_like(bn)
-    for s, c in zip(bscale, cInd):
-        bnu[c] = bn[c] * s  # DONT use 1/intens2dn --that's wrong for real data case!
+    bnu, bscale, cInd = scaleobs(bn, cam)
     #%%
-    if sim.useztranscar:
-        Tm = Mp
-    else:  # interpolate A to be on the same altitude grid as b
-        warn("using interpolated VER, use caution that peaks aren't missed")
-        fint = interp1d(zTranscar, Mp, kind="linear", axis=0)  # faster than loop
-        Tm = asfortranarray(fint(Fwd["z"]))
-
-    sz, nEnergy = Tm.shape
-    assert sz == Fwd["sz"]
-    assert Tm.flags["F_CONTIGUOUS"] is True
+    Tm = eigprofiles(MpDict, sim, Fwd)
+    nEnergy = Tm.shape[1]
     #%% optimization
     """
     Note: Only SLSQP and COBYA allow constraints (Not L-BFGS-B)
@@ -57,56 +43,18 @@ def FitVERopt(L, bn, Phi0, MpDict, sim, cam, Fwd, tInd, P):
     """
 
     if not set(("gaussian", "optim")).isdisjoint(P["makeplot"]):
-        maxiter = sim.optimmaxiter  # it's already int
         sx = Fwd["sx"]
-
-        cons = None
-        optimbound = sim.minflux * ones((nEnergy * sx, 2))  # lower bound
-        optimbound[:, 1] = inf  # None seems to give error  # upper bound
-        if sim.optimfitmeth == "nelder-mead":
-            optimopt = {"maxiter": maxiter, "disp": minverbose}  # 100
-        elif sim.optimfitmeth == "bfgs":
-            optimopt = {"maxiter": maxiter, "disp": minverbose, "norm": 2}  # 20
-        elif sim.optimfitmeth == "tnc":
-            optimopt = {"maxiter": maxiter, "disp": minverbose}  # 20
-        elif sim.optimfitmeth == "l-bfgs-b":
-            # defaults: maxfun=5*nEnergy*sx, maxiter=10
-            optimopt = {
-                "maxfun": maxiter * nEnergy * sx,
-                "maxiter": maxiter,
-                "disp": minverbose,
-            }  # 100 maxiter works well
-        elif sim.optimfitmeth == "slsqp":
-            optimopt = {"maxiter": maxiter, "disp": minverbose}  # 2
-            cons = {"type": "ineq", "fun": difffun}
-        elif sim.optimfitmeth == "cobyla":
-            optimopt = {"maxiter": maxiter, "disp": minverbose, "rhobeg": 1e1, "tol": 1}  # 10
-        else:
-            raise TypeError(f"unknown minimization method: {sim.optimfitmeth}")
+        LT, obs, bnuhit = fitoperator(L, Tm, bnu, sim, Fwd)
 
         tic = time()
         #
-        Phifit = minimize(
-            optfun,
-            x0=Phi0,  # Phi0 is a vector b/c that's what minimize() needs
-            args=(
-                L.tocsr(),
-                Tm,
-                bnu,  # scaled version of bn (do once instead of in loop)
-                nEnergy,
-                sx,
-            ),
-            method=sim.optimfitmeth,
-            bounds=optimbound,  # non-negativity
-            constraints=cons,
-            options=optimopt,
-        )
+        Phifit = fitflux(LT, obs, bnuhit, Phi0, nEnergy, sx, sim, minverbose)
         #
         logging.info("{:0.1f} seconds to fit.".format(time() - tic))
 
         logging.info("Minimizer says: {}".format(Phifit.message))
 
-        Phifit.x = Phifit.x.reshape(nEnergy, sx, order="F")
+        Phifit.x = fullflux(Phifit.x, obs, sim).reshape(nEnergy, sx, order="F")
 
         logging.info("residual={:.1e} after {} func evaluations.".format(Phifit.fun, Phifit.nfev))
 
@@ -126,7 +74,10 @@ def FitVERopt(L, bn, Phi0, MpDict, sim, cam, Fwd, tInd, P):
         # don't remove the two lines above (ek,ekpcolor)
         #%% gaussian fit
         # print('max |diff(phi)| = ' + str(np.abs(np.diff(fitp.x, n=1, axis=0)).max()))
-        gx0, gE0 = getx0E0(None, Phifit["x"], Phifit["EK"], Fwd["x"], tInd, P, sim.minenergy)
+        # the "gfit" figure is made by plotsnew.goPlot
+        gx0, gE0, _ = peakx0E0(
+            None, Phifit["x"], Phifit["EK"], Fwd["x"], sim.minenergy, sim.peakestimator
+        )
 
         if isfinite([gx0[0], gE0[0]]).all():
             print("Model input: (B_\perp,E_0) = ({:.2f}, {:.0f})".format(gx0[0], gE0[0]))
@@ -138,17 +89,287 @@ def FitVERopt(L, bn, Phi0, MpDict, sim, cam, Fwd, tInd, P):
     return vfit, Phifit, Tm, bfit
 
 
-def optfun(phiinv, L, Tm, b_obs, nEnergy, sx):
+def FitVERmc(L, bnK, Phi0, MpDict, sim, cam, Fwd, P):
+    """
+    flux fits of K observation vectors of the same frame (e.g. noise realizations from
+    observeVolume.getObsMC), reusing one precomposed operator.
+
+    bnK: Ncam*Npix x K
+    returns per-realization flux K x Nenergy x Nx and residual, with mean and std. dev. of flux
+    """
+    if Phi0 is None or not sim.optimfitmeth:
+        return
+
+    bnu = scaleobs(bnK, cam)[0]
+    Tm = eigprofiles(MpDict, sim, Fwd)
+    nEnergy, sx = Tm.shape[1], Fwd["sx"]
+    LT, obs, bnu = fitoperator(L, Tm, bnu, sim, Fwd)
+
+    K = bnu.shape[1]
+    phi = empty((K, nEnergy, sx))
+    residual = empty(K)
+    tic = time()
+    for k in range(K):
+        res = fitflux(LT, obs, bnu[:, k], Phi0, nEnergy, sx, sim, bool(P["verbose"]))
+        phi[k] = fullflux(res.x, obs, sim).reshape(nEnergy, sx, order="F")
+        residual[k] = res.fun
+    logging.info("{:0.1f} seconds to fit {} observation vectors.".format(time() - tic, K))
+
+    return {
+        "phi": phi,
+        "residual": residual,
+        "phimean": phi.mean(axis=0),
+        "phistd": phi.std(axis=0),
+    }
+
+
+def scaleobs(bn, cam):
+    """
+    We could repeatedly downscale simulted brightness in loop, but that consumes a lot of CPU.
+    It is equivalent to temporarily upscale observed brightness once before minimization
+    Then downscale once after minimization
+
+    bn: Ncam*Npix vector, or Ncam*Npix x K for K observation vectors
+    """
+    bscale = [C.dn2intens for C in cam if C.usecam]
+    cInd = [C.ind for C in cam if C.usecam]
+    bnu = empty_like(bn)
+    for s, c in zip(bscale, cInd):
+        bnu[c] = bn[c] * s  # DONT use 1/intens2dn --that's wrong for real data case!
+
+    return bnu, bscale, cInd
+
+
+def eigprofiles(MpDict, sim, Fwd):
+    """
+    eigenprofiles on the forward model altitude grid: Nz x Nenergy
+    """
+    Mp, zTranscar = MpDict["Mp"], MpDict["ztc"]
+
+    if sim.useztranscar:
+        Tm = Mp
+    else:  # interpolate A to be on the same altitude grid as b
+        warn("using interpolated VER, use caution that peaks aren't missed")
+        fint = interp1d(zTranscar, Mp, kind="linear", axis=0)  # faster than loop
+        Tm = asfortranarray(fint(Fwd["z"]))
+
+    assert Tm.shape[0] == Fwd["sz"]
+    assert Tm.flags["F_CONTIGUOUS"] is True
+
+    return Tm
+
+
+def fitoperator(L, Tm, bnu, sim, Fwd):
+    """
+    precomposed operator, and the flux unknowns that some camera pixel observes.
+    optionally without the rows of pixels that don't intersect the grid: those only add a
+    constant to the residual. Fwd['hitrows'] maps the kept rows to the rows of bnu.
+    """
+    sx = Fwd["sx"]
+    LT = composeLT(L, Tm, sx)
+    if sim.prunefit and sim.optimfitmeth != "slsqp":  # slsqp constraint needs the full grid
+        obs = observedflux(Fwd.get("voxobs"), L, Tm, sx)
+    else:
+        obs = ones(Tm.shape[1] * sx, dtype=bool)
+    logging.info("fitting {} of {} flux unknowns".format(obs.sum(), obs.size))
+
+    if sim.dropemptyrows and Fwd.get("hitrows") is not None:
+        rows = Fwd["hitrows"]
+        logging.info("fitting {} of {} pixels".format(rows.size, LT.shape[0]))
+        LT, bnu = LT.tocsr()[rows].tocsc(), bnu[rows]
+
+    return LT, obs, bnu
+
+
+def fitflux(LT, obs, bnu, Phi0, nEnergy, sx, sim, minverbose):
+    """
+    minimization over the observed unknowns, single or multiresolution
+    """
+    if sim.multireslevels > 1 and sim.optimfitmeth != "slsqp":
+        return solvemultires(LT, bnu, Phi0, obs, nEnergy, sx, sim, minverbose)
+    else:
+        return solveflux(LT[:, obs], bnu, Phi0[obs], sim, minverbose)
+
+
+def fullflux(x, obs, sim):
+    """
+    flux vector of all unknowns from the fit x of the observed unknowns obs.
+    Unobserved unknowns get sim.minflux, the lower bound of the fitted ones.
+    """
+    phi = full(obs.size, sim.minflux, dtype=float)
+    phi[obs] = x
+
+    return phi
+
+
+def solveflux(LT, bnu, Phi0, sim, minverbose, maxiter=None):
+    """
+    minimize ||LT phi - bnu|| over the flux unknowns phi (a vector), phi >= sim.minflux
+    LT: precomposed sparse operator from composeLT(), possibly with some columns removed
+    maxiter: default sim.optimmaxiter
+    """
+    if maxiter is None:
+        maxiter = sim.optimmaxiter  # it's already int
+    nvar = LT.shape[1]
+
+    cons = None
+    optimbound = sim.minflux * ones((nvar, 2))  # lower bound
+    optimbound[:, 1] = inf  # None seems to give error  # upper bound
+    if sim.optimfitmeth == "nelder-mead":
+        optimopt = {"maxiter": maxiter, "disp": minverbose}  # 100
+    elif sim.optimfitmeth == "bfgs":
+        optimopt = {"maxiter": maxiter, "disp": minverbose, "norm": 2}  # 20
+    elif sim.optimfitmeth == "tnc":
+        optimopt = {"maxiter": maxiter, "disp": minverbose}  # 20
+    elif sim.optimfitmeth == "l-bfgs-b":
+        # defaults: maxfun=5*nEnergy*sx, maxiter=10
+        optimopt = {
+            "maxfun": maxiter * nvar,
+            "maxiter": maxiter,
+            "disp": minverbose,
+        }  # 100 maxiter works well
+    elif sim.optimfitmeth == "slsqp":
+        optimopt = {"maxiter": maxiter, "disp": minverbose}  # 2
+        cons = {"type": "ineq", "fun": difffun}
+    elif sim.optimfitmeth == "cobyla":
+        optimopt = {"maxiter": maxiter, "disp": minverbose, "rhobeg": 1e1, "tol": 1}  # 10
+    else:
+        raise TypeError(f"unknown minimization method: {sim.optimfitmeth}")
+
+    """
+    in single precision, finite difference gradients drown in rounding error,
+    so methods that use a gradient get the analytic one.
+    """
+    jac = None
+    if LT.dtype == float32 and sim.optimfitmeth in ("bfgs", "tnc", "l-bfgs-b", "slsqp"):
+        jac = optgrad
+
+    return minimize(
+        optfun,
+        x0=Phi0,  # Phi0 is a vector b/c that's what minimize() needs
+        args=(LT.tocsr(), bnu.astype(LT.dtype)),  # scaled bn (do once instead of in loop)
+        method=sim.optimfitmeth,
+        jac=jac,
+        bounds=optimbound,  # non-negativity
+        constraints=cons,
+        options=optimopt,
+    )
+
+
+def solvemultires(LT, bnu, Phi0, obs, nEnergy, sx, sim, minverbose):
+    """
+    coarse-to-fine inversion: each coarser level merges pairs of adjacent B_perp cells and of
+    adjacent energy bins. The coarsest level is solved first, and each solution is prolonged
+    (piecewise constant) as the starting point of the next finer level.
+
+    The coarse operator LT @ P sums the columns of L over merged cells and the eigenprofile
+    columns over merged bins, the same convention as transcararc.rebinEnergy(), so a prolonged
+    solution gives the finer level exactly the residual it had on the coarse level.
+
+    The coarse levels only provide the starting point of the next level: level i (0 finest)
+    gets maxiter / 2^i iterations, so all coarse levels together take fewer iterations than
+    the finest level, and each of their iterations costs less.
+    Unobserved unknowns are left out on each level as on the finest, unless pruneUnobserved=no.
+
+    returns the finest level result, over the unknowns in obs, like solveflux()
+    """
+    #%% build the hierarchy, finest first
+    levels = [(LT, obs)]
+    prolong = []
+    nE, nx = nEnergy, sx
+    for _ in range(sim.multireslevels - 1):
+        nEc, nxc = (nE + 1) // 2, (nx + 1) // 2
+        if nEc == nE and nxc == nx:
+            break
+        Pl = kron(groupmatrix(nx, nxc), groupmatrix(nE, nEc), format="csc").astype(LT.dtype)
+        LTc = levels[-1][0].dot(Pl).tocsc()
+        prolong.append(Pl)
+        obsc = diff(LTc.indptr) > 0 if sim.prunefit else ones(LTc.shape[1], dtype=bool)
+        levels.append((LTc, obsc))
+        nE, nx = nEc, nxc
+    #%% initial guess on the coarsest level: average of the fine initial guess in each group
+    phi = Phi0
+    for Pl in prolong:
+        phi = Pl.T.dot(phi) / asarray(Pl.sum(axis=0)).ravel()
+    #%% solve coarse to fine
+    nfev = 0
+    for i in range(len(levels) - 1, -1, -1):
+        LTl, obsl = levels[i]
+        maxiter = sim.optimmaxiter
+        if i > 0 and maxiter:
+            maxiter = max(maxiter // 2 ** i, 1)
+        tic = time()
+        res = solveflux(LTl[:, obsl], bnu, phi[obsl], sim, minverbose, maxiter)
+        nfev += res.nfev
+        logging.info(
+            "multires level {}: {} unknowns, {} iterations, residual={:.1e}  {:.1f} sec.".format(
+                i, obsl.sum(), res.get("nit"), res.fun, time() - tic
+            )
+        )
+
+        phi = phi.copy()
+        phi[obsl] = res.x
+        if i > 0:
+            phi = prolong[i - 1].dot(phi)
+
+    res.nfev = nfev  # total over all levels
+    return res
+
+
+def groupmatrix(n, ngroup):
+    """
+    n x ngroup sparse indicator matrix of adjacent-index groups, as transcararc.energygroups()
+    """
+    group = searchsorted(energygroups(n, ngroup), arange(n), side="right") - 1
+
+    return csr_matrix((ones(n), (arange(n), group)), shape=(n, ngroup))
+
+
+def composeLT(L, Tm, sx):
+    """
+    b = L @ (Tm @ phi).ravel(order='F') as one sparse operator on phi.ravel(order='F'),
+    since the eigenprofiles Tm apply to each B_perp column of the grid alike.
+    """
+    Tm = csr_matrix(Tm, dtype=L.dtype)  # L sets the compute precision
+
+    return L.tocsr().dot(kron(identity(sx, dtype=L.dtype, format="csr"), Tm)).tocsc()
+
+
+def observedflux(voxobs, L, Tm, sx):
+    """
+    boolean mask of flux unknowns (phi.ravel(order='F')) that reach at least one observed voxel.
+
+    voxobs: boolean mask of grid voxels (columns of L) crossed by a camera ray, from getEll.
+    A flux unknown (E,x) is observed if its eigenprofile Tm[:,E] is nonzero in an observed voxel
+    of B_perp column x.
+    """
+    if voxobs is None:
+        voxobs = observedvoxels(L)
+
+    sz = Tm.shape[0]
+    obs = (Tm != 0).T.astype(int).dot(voxobs.reshape(sz, sx, order="F").astype(int)) > 0
+
+    return obs.ravel(order="F")
+
+
+def optfun(phiinv, LT, b_obs):
     """this provides the quantity to minimize
-    Phi0 is a vector b/c that's what minimize needs, reshape is low cost (but this many times?)
+    Phi0 is a vector b/c that's what minimize needs.
+    LT is the precomposed L @ Tm from composeLT(), so one sparse mat-vec per evaluation.
+    """
+    return float(norm(LT.dot(phiinv.astype(LT.dtype, copy=False)) - b_obs, ord=2))
+
+
+def optgrad(phiinv, LT, b_obs):
+    """
+    gradient of optfun(): LT^T (LT phi - b) / ||LT phi - b||
     """
-    # pinv = Tm.dot(phiinv.reshape(nEnergy,sx,order='F'))
-    # binv = L.dot(pinv.ravel(order='F'))
-    #        pinv = Tm @ phiinv.reshape(nEnergy,sx,order='F')
-    #        binv = L  @ pinv.ravel(order='F')
-    binv = L.dot(Tm.dot(phiinv.reshape(nEnergy, sx, order="F")).ravel(order="F"))
+    r = LT.dot(phiinv.astype(LT.dtype, copy=False)) - b_obs
+    nr = norm(r, ord=2)
+    if nr == 0:
+        return zeros(phiinv.size)
 
-    return norm(binv - b_obs, ord=2)
+    return LT.T.dot(r / nr).astype(float)
 
 
 def difffun(jfit, nEnergy=33, sx=109):
@@ -1,9 +1,6 @@
 from pathlib import Path
-import subprocess, os
-import matplotlib
+import os
 
-matplotlib.use("Agg")
-print(matplotlib.get_backend())
 #%%
 from tempfile import mkdtemp
 from argparse import ArgumentParser
@@ -15,7 +12,6 @@ from pymap3d.vincenty import vdist
 
 # from numpy import arange, fromstring
 #%%
-from histutils.camclass import Cam
 from histutils import splitconf
 from .simclass import Sim
 from .arcclass import Arc, getntimes
@@ -24,10 +20,15 @@ from .arcclass import Arc, getntimes
 
 
 def hist_figure(P):
-    from .main_hist import doSim  # KEEP in this function to avoid ImportError
+    from .profiling import PhaseTimer
+
+    timer = PhaseTimer(P.get("profile", False))
+    timer.start()
+    with timer.phase("import"):
+        from .main_hist import doSim  # KEEP in this function to avoid ImportError
 
     print(f'running HiSTfeas program -- will write png and h5 to {P["outdir"]}')
-    doSim(P)
+    doSim(P, timer)
 
 
 def userinput(ini=None, outdir=None):
@@ -42,6 +43,7 @@ def userinput(ini=None, outdir=None):
     p.add_argument("--cx", help="override cam positions (must specify all)", nargs="+", type=float)
     p.add_argument("--iter", help="number of data inversion iterations", type=int)
     p.add_argument("--fitm", help="fit method")
+    p.add_argument("--dtype", help="float32 or float64 for L and the inversion")
 
     p.add_argument("--load", help="load without recomputing", action="store_true")
     p.add_argument(
@@ -50,15 +52,26 @@ def userinput(ini=None, outdir=None):
     p.add_argument("-L", "--ell", help="compute projection matrix", action="store_true")
     p.add_argument("-v", "--verbose", help="verbosity", action="count", default=0)
     p.add_argument("-f", "--frames", help="time steps to use", nargs="+", type=int)
+    p.add_argument(
+        "--profile", help="also write cProfile doSim.pstats to outdir", action="store_true"
+    )
+    p.add_argument(
+        "--defer-plots",
+        help="compute first, then render fwd/optim figures from the results in parallel",
+        action="store_true",
+    )
+    p.add_argument(
+        "--templates",
+        help="build each figure once and update its data every frame (pcolor style)",
+        action="store_true",
+    )
     p = p.parse_args()
 
     if not p.ini:
         raise RuntimeError("you must specify an .ini file")
-    #%% now the other matplotlib imports
-    import seaborn as sns
-
-    sns.color_palette("cubehelix")
-    sns.set(context="paper", style="whitegrid", font_scale=2, rc={"image.cmap": "cubehelix_r"})
+    #%% plotting libraries only when plots are requested
+    if wantplots(p.makeplot):
+        plotsetup()
     #%%
     P = {
         "ini": Path(p.ini).expanduser(),
@@ -66,11 +79,12 @@ def userinput(ini=None, outdir=None):
         "makeplot": p.makeplot,
         "ell": p.ell,
         "verbose": p.verbose,
+        "profile": p.profile,
+        "deferplots": p.defer_plots,
+        "templates": p.templates,
         "overrides": {},
         "cmd": " ".join(argv),
-        "gitrev": subprocess.check_output(["git", "rev-parse", "--short", "HEAD"])
-        .decode("utf8")
-        .strip("\n"),
+        "gitrev": gitrev(),
     }
 
     #%% directory handling
@@ -94,6 +108,7 @@ def userinput(ini=None, outdir=None):
     P["overrides"]["camx"] = p.cx
     P["overrides"]["fitm"] = p.fitm
     P["overrides"]["niter"] = p.iter
+    P["overrides"]["dtype"] = p.dtype
     #%%
     if p.frames is None or len(p.frames) not in (2, 3):
         itime = p.frames
@@ -107,6 +122,62 @@ def userinput(ini=None, outdir=None):
     return P
 
 
+# -m choices of computation and HDF5 output, no figures
+DATAONLY = {"h5", "fwd", "optim", "gaussian"}
+
+
+def wantplots(makeplot):
+    """
+    False for compute-only runs: -m h5, optionally with fwd and optim, and nothing else.
+    Those write the HDF5 results without making figures or importing the plotting modules.
+    """
+    return not ("h5" in makeplot and set(makeplot) <= DATAONLY)
+
+
+def plotsetup():
+    """
+    non-interactive matplotlib backend and the plot style, before any pyplot import
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import seaborn as sns
+
+    sns.color_palette("cubehelix")
+    sns.set(context="paper", style="whitegrid", font_scale=2, rc={"image.cmap": "cubehelix_r"})
+
+
+def gitrev():
+    """
+    short git revision of the source tree, read from .git without running git,
+    else the installed package version
+    """
+    git = Path(__file__).resolve().parents[1] / ".git"
+    try:
+        head = (git / "HEAD").read_text().strip()
+        if head.startswith("ref:"):
+            ref = head.split(maxsplit=1)[1]
+            try:
+                head = (git / ref).read_text().strip()
+            except FileNotFoundError:  # after git gc, refs are in packed-refs
+                for line in (git / "packed-refs").read_text().splitlines():
+                    if line.endswith(" " + ref):
+                        head = line.split()[0]
+                        break
+                else:  # e.g. branch without commits
+                    return "unknown"
+        return head[:7]
+    except OSError:
+        pass
+
+    try:
+        from importlib.metadata import version
+
+        return version("histfeas")
+    except Exception:  # Python < 3.8, or not installed
+        return "unknown"
+
+
 def getParams(P):
     #%% first copy .ini file readonly to output dir for future reference
     if P["outdir"] is not None and not P["load"]:  # running new simulation
@@ -203,6 +274,8 @@ def setupArc(xl):
 
 
 def setupCam(sim, cp, zmax, P):
+    from histutils.camclass import Cam  # imports matplotlib
+
     cam = []
 
     if sim.camxreq is not None:
@@ -3,59 +3,70 @@ from matplotlib.pyplot import figure, close, subplots
 from matplotlib.ticker import (
     MaxNLocator,
 )  # ,ScalarFormatter# ,LogFormatterMathtext, #for 1e4 -> 1 x 10^4, applied DIRECTLY in format=
-from numpy import diff, empty, nan, ndarray, arange
+from numpy import diff, ndarray, arange, stack, tensordot
 import h5py
 
 #
-from .plotsnew import writeplots, getx0E0, plotB
+from .plotsnew import writeplots, plotB
 from .nans import nans
+from .peakest import peaks
+
+FRAMECHUNK = 100  # frames of flux in memory at once
 
 
 def analyseres(sim, cam, x, xp, Phifwd, Phifit, drn, dhat, P, x0true=None, E0true=None):
+    """
+    peak location and average energy of all frames.
+    returns dict of the per-frame results (also written to the results store by readresults)
+    """
     # not Phifit tests for None and []
-    if Phifwd is None or not Phifit or Phifit[0]["x"] is None or x0true is None or E0true is None:
+    if Phifwd is None or not len(Phifit) or Phifit[0]["x"] is None:
+        return
+    if x0true is None or E0true is None:
         return
     """
-    we need to fill zeros in jfwd with machine epsilon, since to get avg we need
-    to divide by jfwd and we'll get NaN if we divide by zero
-
-    gx0:  [:,0]: true x0 gaussian fit (true),   [:,1]: optim x0 gaussian fit (estimate)
-    gE0:  [:,0]: true E0 gaussian fit (true),   [:,1]: optim E0 gaussian fit (estimate)
+    gx0:  [:,0]: true x0 peak fit (true),   [:,1]: optim x0 peak fit (estimate)
+    gE0:  [:,0]: true E0 peak fit (true),   [:,1]: optim E0 peak fit (estimate)
     """
-
-    # jfwd[jfwd==0] = spacing(1) #a.k.a eps()
-    sx = x.size
-    nit = len(Phifit) if Phifit is not None else len(Phifwd)
-
-    #%% energy flux plot amd calculations
+    nit = len(Phifit)
+    Ek = Phifit[0]["EK"]
+    Phifwd = Phifwd if len(Phifwd) else None
+    dE = energywidths(Phifit[0]["EKpcolor"])
+    #%% peaks and average energy of each x, in blocks of frames read from the store
     gx0 = nans((nit, 2))
     gE0 = nans((nit, 2))
-    Eavgfwdx = nans((nit, sx))
-    Eavghatx = nans((nit, sx))
-
-    #%% back to work
-    for i, jf in enumerate(Phifit):
-        if Phifwd is None or len(Phifwd) == 0:  # "not Phifwd" is not appropriate due to ndarray
-            phif = None
-        else:
-            phif = Phifwd[..., i]
-        # note even if array is F_CONTIGUOUS, argmax is C-order!!
-        gx0[i, :], gE0[i, :] = getx0E0(phif, jf["x"], jf["EK"], x, None, P, sim.minenergy)
-
+    Eavghatx = nans((nit, x.size))
+    Eavgfwdx = None if Phifwd is None else nans((nit, x.size))
+    for i in range(0, nit, FRAMECHUNK):
+        t = slice(i, min(i + FRAMECHUNK, nit))
+        # Nenergy x Nx x Nchunk
+        Phihat = stack([Phifit[j]["x"] for j in range(t.start, t.stop)], axis=-1)
+        gx0[t, 1], gE0[t, 1] = peaks(Phihat, Ek, x, sim.minenergy, sim.peakestimator)
+        Eavghatx[t] = avgenergy(Phihat, Ek, dE).T
+        if Phifwd is not None:
+            phi = Phifwd[..., t]
+            gx0[t, 0], gE0[t, 0] = peaks(phi, Ek, x, sim.minenergy, sim.peakestimator)
+            Eavgfwdx[t] = avgenergy(phi, Ek, dE).T
+
+    for i in range(nit):
         print(
-            "t={} gaussian 2-D fits for (x,E):\n"
+            "t={} {} 2-D peak fits for (x,E):\n"
             " Fwdtrue: {:.2f} {:.0f}\n"
             " Fwdfit:  {:.2f} {:.0f}\n"
             " Optim:   {:.2f} {:.0f}\n".format(
-                i, x0true[i], E0true[i], gx0[i, 0], gE0[i, 0], gx0[i, 1], gE0[i, 1]
+                i,
+                sim.peakestimator,
+                x0true[i],
+                E0true[i],
+                gx0[i, 0],
+                gE0[i, 0],
+                gx0[i, 1],
+                gE0[i, 1],
             )
         )
-
-        Eavgfwdx[i, :], Eavghatx[i, :] = avgcomp(phif, jf["x"], jf["EK"], x, P)
-
     #%% overall error
-    gx0err = gx0[:, 1] - x0true  # -gx0[:,0]
-    gE0err = gE0[:, 1] - E0true  # -gE0[:,0]
+    gx0err = gx0[:, 1] - x0true[:nit]  # -gx0[:,0]
+    gE0err = gE0[:, 1] - E0true[:nit]  # -gE0[:,0]
     #%% plots
     # extplot(sim,cam,drn,dhat,P)
 
@@ -63,6 +74,17 @@ def analyseres(sim, cam, x, xp, Phifwd, Phifit, drn, dhat, P, x0true=None, E0tru
 
     plotgauss(x0true, gx0, gE0, gx0err, gE0err, P)
 
+    return {
+        "gx0": gx0,
+        "gE0": gE0,
+        "x0true": x0true[:nit],
+        "E0true": E0true[:nit],
+        "gx0err": gx0err,
+        "gE0err": gE0err,
+        "Eavgfwd": Eavgfwdx,
+        "Eavghat": Eavghatx,
+    }
+
 
 def doplot(x, Phifit, gE0, Eavgfwdx, Eavghatx, P):
     #    with open('cord.csv','r') as e:
@@ -84,7 +106,7 @@ def doplot(x, Phifit, gE0, Eavgfwdx, Eavghatx, P):
                 close(fg)
                 pass
 
-        if "fwd" in P["makeplot"] and Eavgfwdx:
+        if "fwd" in P["makeplot"] and Eavgfwdx is not None:
             fgf = figure()
             ax = fgf.gca()
             ax.semilogy(x, Eavgfwdx.T, marker=".")
@@ -94,7 +116,7 @@ def doplot(x, Phifit, gE0, Eavgfwdx, Eavghatx, P):
             ax.legend(["{:.0f} eV".format(g) for g in gE0[:, 0]], loc="best", fontsize=9)
             writeplots(fgf, "Eavg_fwd", 9999, P["makeplot"], P["outdir"])
 
-        if "optim" in P["makeplot"] and Eavghatx:
+        if "optim" in P["makeplot"] and Eavghatx is not None:
             fgo = figure()
             ax = fgo.gca()
             ax.semilogy(x, Eavghatx.T, marker=".")
@@ -173,48 +195,18 @@ def plotgauss(x0true, gx0, gE0, gx0err, gE0err, P):
 
 
 #%%
-def avgcomp(Phifwd, Phifit, Ek, x, P):
-    if Phifwd is None:
-        return nan, nan
-
-    nEnergy = Phifwd.shape[0]
-
-    dE = empty(nEnergy)
-    dE[0] = 9.952  # a priori for this pre-arranged EK
-    dE[1:] = diff(Ek)  # per Dahlgren matlab code line 276-280
-    # from numpy.testing import assert_allclose
-    Eavgfwd = (Phifwd * Ek[:, None] * dE[:, None]).sum(axis=0) / (Phifwd * dE[:, None]).sum(axis=0)
-
-    # xi = 43 #a priori from x=0.5km
-
-    # jfwd1d = jfwd[:,xi]
-    # Eavgfwd1d = (jfwd1d * Ek * dE).sum() / (jfwd1d * dE).sum()
-
-    # assert_allclose(Eavgfwd1d,Eavgfwd[xi])
-
-    # print('E_avg: {:0.1f}'.format(Eavgfwd1d))
-    logging.info("E_avg: ", Eavgfwd[0])  # TODO how to pick
-    if "eavg" in P["makeplot"]:
-        fg = figure()
-        ax = fg.gca()
-        # ax.loglog(Ek,jfwd1d,marker='.')
-        ax.semilogy(x, Eavgfwd)
-        ax.set_ylim(bottom=1)
-        # ax.set_xlim(50,20e3)
-        ax.set_title("2-D cut to 1-D ")
-        # ax.set_xlabel('Energy [eV]')
-        ax.set_xlabel("x [km]")
-        ax.set_ylabel("diff. num. flux")
-
-        writeplots(fg, "Eavg_fwd1d", 9999, P["makeplot"], P["outdir"])
-
-        #%% average energy per x-location
-        # formula is per JGR 2013 Dahlgren et al.
-        # E_avg = sum(flux*E*dE) / sum(flux*dE)
-        Eavgfwdx = (Phifwd * Ek[:, None] * dE[:, None]).sum(axis=0) / (Phifwd * dE[:, None]).sum(
-            axis=0
-        )
+def energywidths(EKpcolor):
+    """
+    energy bin widths dE of the average energy weights, from the Nenergy+1 bin edges EKpcolor,
+    so they follow any rebinning of the energy grid (transcararc.rebinEnergy)
+    """
+    return diff(EKpcolor)
+
 
-        Eavghatx = (x * Ek[:, None] * dE[:, None]).sum(axis=0) / (x * dE[:, None]).sum(axis=0)
-        return Eavgfwdx, Eavghatx
-    return nan, nan
+def avgenergy(Phi, Ek, dE):
+    """
+    average energy per x-location, of Nenergy x Nx [x Ntime] flux Phi
+    formula is per JGR 2013 Dahlgren et al.
+    E_avg = sum(flux*E*dE) / sum(flux*dE)
+    """
+    return tensordot(Ek * dE, Phi, axes=(0, 0)) / tensordot(dE, Phi, axes=(0, 0))
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+catalog of the key results of many runs (e.g. a sweep of camera position or iterations),
+one row per frame, as columns of one HDF5 file. Only runs that are new or changed since the
+last update are read, so sweep-level analysis doesn't reopen hundreds of result files.
+
+python -m histfeas.catalog out/
+"""
+from pathlib import Path
+import logging
+from hashlib import md5
+import h5py
+from numpy import asarray, nan, sqrt
+
+from .results import STORENAME
+
+CATALOG = "catalog.h5"
+
+
+def updatecatalog(root, fn=None):
+    """
+    scan root for run output directories (containing results.h5), return the catalog
+    as dict of column arrays, and write it to root/catalog.h5 (or fn)
+    """
+    root = Path(root).expanduser()
+    fn = root / CATALOG if fn is None else Path(fn).expanduser()
+
+    old = loadcatalog(fn) if fn.is_file() else {}
+    known = {}  # run: mtime of its results when cataloged
+    if old:
+        for r, t in zip(old["run"], old["mtime"]):
+            known[r] = t
+
+    keep = []
+    rows = []
+    for store in sorted(root.rglob(STORENAME)):
+        run = str(store.parent.relative_to(root))
+        mtime = store.stat().st_mtime
+        if known.get(run) == mtime:
+            keep.append(run)
+            continue
+
+        try:
+            rows += scanrun(store, run, mtime)
+        except (OSError, KeyError) as e:
+            logging.error(f"skipping {store}  {e}")
+
+    print(f"catalog {fn}: {len(keep)} runs unchanged, {len(set(r['run'] for r in rows))} scanned")
+
+    if old:
+        i = [j for j, r in enumerate(old["run"]) if r in keep]
+        rows = [{k: v[j] for k, v in old.items()} for j in i] + rows
+
+    cat = columns(rows)
+    writecatalog(fn, cat, root)
+
+    return cat
+
+
+def scanrun(store, run, mtime):
+    """
+    catalog rows of one run: run parameters from the results.h5 attributes,
+    (x0, E0) of the estimate (and of the forward model, once analysed by readresults),
+    and reprojection residual for each frame
+    """
+    ini = sorted(store.parent.glob("*.ini"))
+    confighash = md5(ini[0].read_bytes()).hexdigest() if ini else ""
+
+    with h5py.File(str(store), "r", libver="latest") as f:
+        A = f.attrs
+        run = {
+            "run": run,
+            "mtime": mtime,
+            "confighash": confighash,
+            "fitm": str(A.get("fitm", "")),
+            "niter": float(A["niter"]) if "niter" in A else nan,
+            "runtime": float(A.get("runtime", nan)),
+            "gitrev": str(A.get("gitrev", "")),
+        }
+        for i, x in enumerate(A.get("camx", [])):
+            run[f"camx{i}"] = float(x)
+
+        times = f["/time"].asstr()[()]
+        gx0 = f["/phiest/gx0"][()] if "/phiest/gx0" in f else None
+        gE0 = f["/phiest/gE0"][()] if "/phiest/gE0" in f else None
+        # (x0, E0) of the forward model, from the analysis by readresults (first arc)
+        ana = next(iter(f["/analysis"].values())) if "/analysis" in f else None
+        if ana is not None and "gx0" in ana:
+            gfwd = ana["gx0"][:, 0], ana["gE0"][:, 0]
+        else:
+            gfwd = None
+
+        if "/best/bfit" in f:
+            res = sqrt(((f["/best/bfit"][()] - f["/best/braw"][()]) ** 2).sum(axis=1))
+        else:
+            res = None
+
+    rows = []
+    for i, t in enumerate(times):
+        r = dict(run, frame=t)
+        if gx0 is not None:
+            r.update(gx0=gx0[i], gE0=gE0[i])
+        if gfwd is not None and i < gfwd[0].size:
+            r.update(gx0fwd=gfwd[0][i], gE0fwd=gfwd[1][i])
+        if res is not None:
+            r["residual"] = res[i]
+        rows.append(r)
+
+    return rows
+
+
+def columns(rows):
+    """
+    list of row dicts to dict of column arrays. Missing values: '' for text, NaN for numbers.
+    """
+    keys = []
+    for r in rows:
+        keys += [k for k in r if k not in keys]
+
+    cat = {}
+    for k in keys:
+        text = any(isinstance(r.get(k), str) for r in rows)
+        miss = "" if text else nan
+        cat[k] = asarray([r.get(k, miss) for r in rows], dtype=object if text else float)
+
+    return cat
+
+
+def writecatalog(fn, cat, root):
+    with h5py.File(str(fn), "w", libver="latest") as f:
+        f.attrs["root"] = str(root)
+        for k, v in cat.items():
+            if v.dtype == object:
+                f.create_dataset(k, data=v.astype(str).tolist(), dtype=h5py.string_dtype())
+            else:
+                f[k] = v
+
+
+def loadcatalog(fn):
+    """
+    catalog as dict of column arrays
+    """
+    with h5py.File(str(Path(fn).expanduser()), "r", libver="latest") as f:
+        return {
+            k: D.asstr()[()] if h5py.check_string_dtype(D.dtype) else D[()] for k, D in f.items()
+        }
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    p = ArgumentParser(description="catalog results of the runs under a directory")
+    p.add_argument("root", help="directory containing run output directories")
+    p = p.parse_args()
+
+    cat = updatecatalog(p.root)
+    if cat:
+        cols = [k for k in ("run", "frame", "niter", "gx0", "gE0", "residual") if k in cat]
+        print("  ".join(cols))
+        for j in range(cat["run"].size):
+            print("  ".join(str(cat[k][j]) for k in cols))
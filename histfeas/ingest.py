@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+streaming real data ingest: HiST raw video files are read a chunk of frames at a time
+to extract the 1-D cuts (keogram), instead of loading Ncam x Nframe x Ny x Nx at once.
+Raw frames for realvid/singleraw plots are read on demand into a small bounded cache.
+"""
+import logging
+from collections import OrderedDict
+from time import time
+import h5py
+from numpy import empty, unique
+
+#
+from histutils.simulFrame import HSTsync
+from histutils.get1Dcut import get1Dcut
+
+CHUNKFRAMES = 100  # frames read from disk per step of the keogram extraction
+
+
+def getStreamData(sim, cam, odir=None, verbose=0):
+    """
+    streaming version of histutils.simulFrame.getSimulData()
+    returns rawdata as one RawFrames per used camera, indexed like the nframe x ny x nx arrays
+    """
+    cam, sim = HSTsync(sim, cam, verbose)
+    # %% load 1D cut coord
+    try:
+        cam = get1Dcut(cam, odir, verbose)
+    except (AttributeError, OSError):
+        pass
+
+    logging.info("streaming 1-D cuts from raw data, {} frame window".format(sim.rawframewindow))
+    tic = time()
+    rawdata = []
+    for C in cam:
+        if not C.usecam or len(C.pbInd) < 1:
+            continue
+        # NOTE C.ut1unix is timeshift corrected, f['/ut1_unix'] is UNcorrected!
+        C.tKeo = C.ut1unix[C.pbInd]
+
+        if hasattr(C, "cutrow"):
+            C.keo = getkeo(C)
+
+        rawdata.append(RawFrames(C, sim.rawframewindow))
+
+    logging.debug("extracted 1-D cuts in {:.2f} sec.".format(time() - tic))
+
+    return cam, rawdata, sim
+
+
+def getkeo(C, chunk=CHUNKFRAMES):
+    """
+    1-D cut of each frame C.pbInd: Npix x Nframe, reading at most chunk frames at a time.
+    Repeated frames (slower camera) are read once.
+    """
+    # h5py fancy indexing must be increasing and non-repeated
+    ind, inv = unique(C.pbInd, return_inverse=True)
+
+    keo = None
+    with h5py.File(str(C.fn), "r", libver="latest") as f:
+        for i in range(0, ind.size, chunk):
+            im = C.doorientimage(f["/rawimg"][ind[i : i + chunk], ...])
+            cut = im[:, C.cutrow, C.cutcol].T  # row = pix, col = time
+            if keo is None:
+                keo = empty((cut.shape[0], ind.size), dtype=cut.dtype)
+            keo[:, i : i + chunk] = cut
+
+    return keo[:, inv]
+
+
+class RawFrames:
+    """
+    oriented raw frames of one camera, read from disk on request.
+    rawdata[t] or rawdata[t, ...] is frame C.pbInd[t], as with the in-memory nframe x ny x nx array.
+    At most window frames are kept, least recently used are dropped.
+    """
+
+    def __init__(self, C, window):
+        self.C = C
+        self.fn = C.fn
+        self.pbInd = C.pbInd
+        self.window = max(int(window), 1)
+        self.cache = OrderedDict()
+
+        with h5py.File(str(self.fn), "r", libver="latest") as f:
+            ny, nx = C.doorientimage(f["/rawimg"][self.pbInd[0], ...]).shape
+
+        self.shape = (len(self.pbInd), ny, nx)
+        self.ndim = 3
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            t, rest = key[0], key[1:]
+        else:
+            t, rest = key, ()
+
+        frame = self.frame(t)
+
+        return frame[rest] if rest else frame
+
+    def frame(self, t):
+        i = int(self.pbInd[t])
+        if i in self.cache:
+            self.cache.move_to_end(i)
+            return self.cache[i]
+
+        with h5py.File(str(self.fn), "r", libver="latest") as f:
+            frame = self.C.doorientimage(f["/rawimg"][i, ...])
+
+        self.cache[i] = frame
+        if len(self.cache) > self.window:
+            self.cache.popitem(last=False)
+
+        return frame
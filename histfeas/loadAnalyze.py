@@ -5,89 +5,34 @@ To generate inputs for this program, run main_hist.py with
 option
 """
 from __future__ import division
+from concurrent.futures import ThreadPoolExecutor
 import h5py
-from numpy import asarray, diff
-from matplotlib.pyplot import show, close
+from numpy import asarray, diff, moveaxis, stack
 
 #
-from .analysehst import analyseres
 from . import getParams
-from .plotsnew import plotoptim, plotfwd
-from .observeVolume import definecamind
+from .observeVolume import definecamind, loadhit
+from .results import STORENAME, writeanalysis
 
 
 def readresults(h5list, P):
-    Phifwd = []
-    Phidict = []
-    dhat = []
-    drn = []
-    Pest = []
-    Pfwd = []
-    ut1_unix = []
     #%%
     if not h5list:
         print("no HDF5 files found from your analysis run.")
         return
 
-    if len(h5list) > 500:
-        print("loading {} files from {}".format(len(h5list), h5list[0].parent))
-
-    for h5 in h5list:
-        assert h5.is_file()
-        with h5py.File(str(h5), "r", libver="latest") as f:
-            try:  # simulation
-                Phifwd.append(f["/phifwd/phi"].value)
-                Pfwd.append(f["/pfwd/p"].value)
-            except KeyError:  # real data
-                pass
-
-            try:
-                Phidict.append(
-                    {
-                        "x": f["/phiest/phi"].value,
-                        "EK": f["/phiest/Ek"].value,
-                        "EKpcolor": f["/phiest/EKpcolor"].value,
-                        "gx0": f["/phiest/gx0"].value,
-                        "gE0": f["/phiest/gE0"].value,
-                    }
-                )
-
-                Pest.append(f["/pest/p"].value)
-
-                x = f["/pest/x"].value  # same for all in directory
-                xp = f["/pest/xp"].value
-                z = f["/pest/z"].value
-                zp = f["/pest/zp"].value
-
-                dhat.append(f["/best/bfit"].value)
-                drn.append(f["/best/braw"].value)
-
-                angle_deg = f[
-                    "/best/angle"
-                ].value  # NOTE: by definition, same angles for all time steps-the camera is not moving!
-
-                try:  # realdata
-                    ut1_unix.append(f["/best/ut1_unix"].value)
-                except KeyError:  # simulation, not real data
-                    pass
-
-            except KeyError as e:
-                raise KeyError(
-                    "It seems that data inversion did not complete?\nOr at least it was not written\n  {}".format(
-                        e
-                    )
-                )
+    if len(h5list) == 1 and h5list[0].name == STORENAME:
+        R = readstore(h5list[0])
+    else:
+        R = readdumps(h5list)
 
+    Phifwd, Phidict, Pfwd, Pest = R["Phifwd"], R["Phidict"], R["Pfwd"], R["Pest"]
+    dhat, drn, ut1_unix, angle_deg = R["dhat"], R["drn"], R["ut1_unix"], R["angle_deg"]
+    x, xp, z, zp = R["x"], R["xp"], R["z"], R["zp"]
     #%% read sim parameters
-    if Phifwd:  # sim data
-        Phifwd = asarray(Phifwd).transpose(1, 2, 0)  # result: Nenergy x Nx x Ntime
-
     arc, sim, cam, Fwd, P = getParams(P)
-    #%% load L
-    with h5py.File(str(sim.FwdLfn), "r", libver="latest") as f:
-        Lfwd = f["L"].value
-
-    cam = definecamind(cam, Lfwd)
+    #%% camera pixel indices, from the hit pixel index of the Ell file
+    cam = definecamind(cam, None, loadhit(sim))
     #%% load original angles of camera
     ut1_unix = asarray(ut1_unix)
     for i, C in enumerate(cam):
@@ -95,6 +40,11 @@ def readresults(h5list, P):
             C.angle_deg = angle_deg[i, :]
             C.tKeo = ut1_unix[:, i]
     #%% load arcs if they exist
+    if arc:
+        from .analysehst import analyseres  # makes plots
+
+    analyses = {}
+
     for k, a in arc.items():
         """
         TODO: assumes for all time steps arc is same distance apart (zero accel)
@@ -111,10 +61,23 @@ def readresults(h5list, P):
             x0true = a.X0km[:-1] + 0.5 * diff(a.X0km)
             E0true = a.E0[:-1] + 0.5 * diff(a.E0)
 
-        analyseres(sim, cam, x, xp, Phifwd, Phidict, drn, dhat, P, x0true, E0true)
+        A = analyseres(sim, cam, x, xp, Phifwd, Phidict, drn, dhat, P, x0true, E0true)
+        if A is not None:
+            analyses[k] = A
+    #%% analysis results into the store, opened for writing only there
+    if analyses and R.get("store") is not None:
+        fn = R["store"].filename
+        R["store"].close()
+        writeanalysis(fn, analyses)
+        R = readstore(fn)  # read-only again, for the plots and the returned arrays
+        Phifwd, Phidict, Pfwd, Pest = R["Phifwd"], R["Phidict"], R["Pfwd"], R["Pest"]
+        dhat, drn = R["dhat"], R["drn"]
 
     #%% plots
     if P["load"]:
+        from matplotlib.pyplot import show, close
+        from .plotsnew import plotoptim, plotfwd
+
         for i in range(len(drn)):  # for each time, do...
             try:  # simulation
                 pf = Pfwd[i]
@@ -156,13 +119,175 @@ def readresults(h5list, P):
     return Phifwd, Phidict
 
 
+# per-frame variables and the HDF5 path they are written to
+FRAMEVARS = {
+    "Phifwd": "/phifwd/phi",  # simulation only
+    "Pfwd": "/pfwd/p",  # simulation only
+    "phi": "/phiest/phi",
+    "gx0": "/phiest/gx0",
+    "gE0": "/phiest/gE0",
+    "Pest": "/pest/p",
+    "dhat": "/best/bfit",
+    "drn": "/best/braw",
+    "ut1_unix": "/best/ut1_unix",
+}
+# same for every frame of a run
+# NOTE: by definition, same angles for all time steps-the camera is not moving!
+RUNVARS = {
+    "x": "/pest/x",
+    "xp": "/pest/xp",
+    "z": "/pest/z",
+    "zp": "/pest/zp",
+    "angle_deg": "/best/angle",
+    "EK": "/phiest/Ek",
+    "EKpcolor": "/phiest/EKpcolor",
+}
+
+NOTDONE = "It seems that data inversion did not complete?\nOr at least it was not written\n  {}"
+
+
+def readdumps(h5list):
+    """
+    results of a run written as one dump HDF5 file per frame.
+    The per-run variables are read once, the per-frame arrays by a thread pool over the files.
+    """
+    if len(h5list) > 500:
+        print("loading {} files from {}".format(len(h5list), h5list[0].parent))
+
+    with h5py.File(str(h5list[0]), "r", libver="latest") as f:
+        try:
+            R = {k: f[v][()] for k, v in RUNVARS.items()}
+        except KeyError as e:
+            raise KeyError(NOTDONE.format(e))
+
+    with ThreadPoolExecutor(max_workers=min(8, len(h5list))) as pool:
+        frames = list(pool.map(readframe, h5list))
+
+    for k in FRAMEVARS:
+        if all(k in fr for fr in frames):
+            R[k] = stack([fr[k] for fr in frames])
+        else:  # real data: no forward model
+            R[k] = []
+
+    if len(R["Phifwd"]):
+        R["Phifwd"] = R["Phifwd"].transpose(1, 2, 0)  # result: Nenergy x Nx x Ntime
+
+    R["Phidict"] = [
+        {"x": phi, "EK": R["EK"], "EKpcolor": R["EKpcolor"], "gx0": gx0, "gE0": gE0}
+        for phi, gx0, gE0 in zip(R["phi"], R["gx0"], R["gE0"])
+    ]
+
+    return R
+
+
+def readframe(h5):
+    with h5py.File(str(h5), "r", libver="latest") as f:
+        for k in ("/phiest/phi", "/best/bfit"):
+            if k not in f:
+                raise KeyError(NOTDONE.format(h5))
+
+        return {k: f[v][()] for k, v in FRAMEVARS.items() if v in f}
+
+
+def readstore(fn):
+    """
+    results of a run from the single results.h5 store. Only the per-run variables and the
+    small per-frame vectors are read here; images and flux maps are read a frame at a time
+    when indexed, so memory does not grow with the number of frames.
+    The file stays open read-only as long as the returned arrays are in use.
+    """
+    f = h5py.File(str(fn), "r", libver="latest")
+
+    for k in ("/phiest/phi", "/best/bfit"):
+        if k not in f:
+            raise KeyError(NOTDONE.format(fn))
+
+    R = {k: f[v][()] for k, v in RUNVARS.items()}
+    for k in ("gx0", "gE0", "ut1_unix"):
+        R[k] = f[FRAMEVARS[k]][()]
+
+    for k in ("Pfwd", "phi", "Pest", "dhat", "drn"):
+        R[k] = FrameArray(f[FRAMEVARS[k]]) if FRAMEVARS[k] in f else []
+
+    R["Phifwd"] = FrameArray(f["/phifwd/phi"], timelast=True) if "/phifwd/phi" in f else []
+    R["Phidict"] = PhiFrames(R)
+    R["store"] = f
+
+    return R
+
+
+class FrameArray:
+    """
+    lazy Ntime x ... dataset of the results store: a[i] reads frame i only.
+    timelast: indexed a[..., i] or a[..., i:j] as the in-memory ... x Ntime arrays (Phifwd).
+    """
+
+    def __init__(self, D, timelast=False):
+        self.D = D
+        self.timelast = timelast
+        self.shape = D.shape[1:] + D.shape[:1] if timelast else D.shape
+        self.ndim = D.ndim
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        if self.timelast:
+            if not (isinstance(key, tuple) and len(key) == 2 and key[0] is Ellipsis):
+                raise IndexError("index time-last store arrays as [..., i]")
+            a = self.D[key[1]]
+            return moveaxis(a, 0, -1) if isinstance(key[1], slice) else a
+
+        return self.D[key]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __array__(self, dtype=None, copy=None):
+        a = self.D[()]
+        if self.timelast:
+            a = moveaxis(a, 0, -1)
+        return a if dtype is None else a.astype(dtype)
+
+
+class PhiFrames:
+    """
+    lazy list of the per-frame estimated flux dicts, as built by readdumps()
+    """
+
+    def __init__(self, R):
+        self.R = R
+
+    def __len__(self):
+        return len(self.R["phi"])
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError(i)
+
+        R = self.R
+        return {
+            "x": R["phi"][i],
+            "EK": R["EK"],
+            "EKpcolor": R["EKpcolor"],
+            "gx0": R["gx0"][i],
+            "gE0": R["gE0"][i],
+        }
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
 def findxlsh5(P):
 
     if P["outdir"].is_file():
         flist = [P["outdir"]]
         inifn = sorted(P["outdir"].parent.glob("*.ini"))
     elif P["outdir"].is_dir():
-        flist = sorted(P["outdir"].glob("dump*.h5"))
+        store = P["outdir"] / STORENAME
+        flist = [store] if store.is_file() else sorted(P["outdir"].glob("dump*.h5"))
         inifn = sorted(P["outdir"].glob("*.ini"))
     else:
         raise FileNotFoundError("no path or file at {}".format(P["outdir"]))
@@ -191,4 +316,6 @@ if __name__ == "__main__":
         h5list, xlsfn, vlim=None, Jxi=None, overrides=None, makeplot=p.makeplot, verbose=p.verbose
     )
 
+    from matplotlib.pyplot import show
+
     show()
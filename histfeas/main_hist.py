@@ -17,47 +17,80 @@ from sys import argv
 from numpy import absolute, zeros, outer
 from numpy.random import normal
 from time import time
-from matplotlib.pyplot import close, draw, pause, show
 
 #
 from gridaurora.eFluxGen import maxwellian
-from histutils.simulFrame import getSimulData
-from histutils.get1Dcut import get1Dcut  # we need cam.angle_deg for plotting
 
 #
-from . import getParams
+from . import getParams, wantplots
 from .AuroraFwdModel import getSimVER
-from .transcararc import getMp, getPhi0, getpx  # calls matplotlib
-from .observeVolume import getEll, getObs  # calls matplotlib
-from .FitVER import FitVERopt as FitVER  # calls matplotlib
-from .plotsnew import goPlot  # calls matplotlib
+from .transcararc import getMp, getPhi0, getpx
+from .observeVolume import getEll, getObs, getObsBatch, getObsMC
+from .FitVER import FitVERopt as FitVER, FitVERmc
+from .results import dumph5, dumpframe, tind2dt, openstore, closestore
+from .profiling import PhaseTimer
+from .writer import startwriter, stopwriter
 
 
-def doSim(P):
+def doSim(P, timer=None):
     print("")
     #%% housekeeping
     tic = time()
     logging.basicConfig(level=30 - P["verbose"] * 10)
+    if timer is None:  # called directly, not via hist_figure
+        timer = PhaseTimer(P.get("profile", False))
+        timer.start()
+    # compute-only runs (-m h5) make no figures
+    plots = wantplots(P["makeplot"])
+    # --defer-plots: fwd and optim figures are rendered from the results after the loop,
+    # any other figures are still made in the loop
+    deferred = plots and P.get("deferplots", False)
+    if plots:
+        with timer.phase("import"):
+            from matplotlib.pyplot import draw, pause, show
+            from .plotsnew import goPlot, closeplots, cleartemplates
     #%% Step 0) load data
-    arc, sim, cam, Fwd, P = getParams(P)
+    with timer.phase("getParams"):
+        arc, sim, cam, Fwd, P = getParams(P)
+    #%% one results file for the whole run
+    openstore(P["outdir"], runmeta(sim, cam, P))
+    startwriter(sim.writequeue)  # output of frame t written while frame t+1 is computed
     #%% setup loop
-    if sim.realdata:
-        # can load enormous amount of data into rawdata, Ncam x Nframe x Ny x Nx (verify dim order?)
-        cam, rawdata, sim = getSimulData(sim, cam, P["outdir"], P["verbose"])
-    else:  # simulation
-        rawdata = None
-        if sim.raymap == "astrometry":
-            cam = get1Dcut(cam, P["outdir"], P["verbose"])
+    with timer.phase("data"):
+        # histutils video and 1-D cut readers import its plotting helpers: only where used
+        if sim.realdata:
+            # can load enormous amount of data into rawdata, Ncam x Nframe x Ny x Nx
+            if sim.rawframewindow:  # constant memory: keogram streamed, raw frames on demand
+                from .ingest import getStreamData
+
+                cam, rawdata, sim = getStreamData(sim, cam, P["outdir"], P["verbose"])
+            else:
+                from histutils.simulFrame import getSimulData
+
+                cam, rawdata, sim = getSimulData(sim, cam, P["outdir"], P["verbose"])
+        else:  # simulation
+            rawdata = None
+            if sim.raymap == "astrometry":
+                from histutils.get1Dcut import get1Dcut  # we need cam.angle_deg for plotting
+
+                cam = get1Dcut(cam, P["outdir"], P["verbose"])
     timeInds = sim.maketind(P["timeinds"])
     #%% Step 1) get projection matrix
-    Lfwd, Fwd, cam = getEll(sim, cam, Fwd, P)
+    with timer.phase("getEll"):
+        Lfwd, Fwd, cam = getEll(sim, cam, Fwd, P)
     #%% load eigenprofiles from Transcar
-    Peig = getMp(sim, cam, Fwd["z"], P["makeplot"])
+    with timer.phase("getMp"):
+        Peig = getMp(sim, cam, Fwd["z"], P["makeplot"])
     #%% synthetic diff. num flux
-    Phi0all = getPhi0(sim, arc, Fwd["x"], Peig["Ek"], P["makeplot"])  # Nenergy x Nx x Ntime
+    with timer.phase("getPhi0"):
+        Phi0all = getPhi0(sim, arc, Fwd["x"], Peig, P["makeplot"])  # Nenergy x Nx x Ntime
+    #%% real data: all observation vectors in one pass over the keograms
+    if sim.realdata:
+        with timer.phase("getObsBatch"):
+            bnall = getObsBatch(sim, cam, timeInds)  # Ncam*Npixel x Ntime
     print("{:.1f} sec to prepare for HiSTfeas loop".format(time() - tic))
     #%%start looping for each time slice in keogram (just once if simulated)
-    for ti in timeInds:
+    for j, ti in enumerate(timeInds):
         logging.info("entering time {}".format(ti))
         if sim.realdata:
             Phi0 = None
@@ -69,28 +102,76 @@ def doSim(P):
             """
             Phi0 = Phi0all[..., ti]  # Nenergy x Nx
         #%% Step 1) Forward model
-        Pfwd = getSimVER(Phi0, Peig, Fwd, sim, arc, ti)  # Nz x Nx
+        with timer.phase("forward", ti):
+            Pfwd = getSimVER(Phi0, Peig, Fwd, sim, arc, ti)  # Nz x Nx
         #%% Step 2) Observe Forward Model (create vector of observations)
-        bn = getObs(sim, cam, Lfwd, ti, Pfwd)  # Ncam*Npixel (1D vector)
+        with timer.phase("observe", ti):
+            if sim.realdata:
+                bn = bnall[:, j]
+            else:
+                bn = getObs(sim, cam, Lfwd, ti, Pfwd)  # Ncam*Npixel (1D vector)
         #%% Step 3) fit constituent energies to our estimated vHat and reproject
-        Phi0r = initPhi(Phi0, Peig, Fwd, P["overrides"])
-        Pfit, jfit, Tm, bfit = FitVER(Lfwd, bn, Phi0r, Peig, sim, cam, Fwd, ti, P)
+        with timer.phase("fit", ti):
+            Phi0r = initPhi(Phi0, Peig, Fwd, P["overrides"])
+            Pfit, jfit, Tm, bfit = FitVER(Lfwd, bn, Phi0r, Peig, sim, cam, Fwd, ti, P)
+        #%% Monte Carlo: error statistics over noise realizations of this frame
+        if sim.noiserealizations and not sim.realdata:
+            with timer.phase("montecarlo", ti):
+                seed = None if sim.noiseseed is None else (sim.noiseseed, ti)  # distinct per frame
+                bnK = getObsMC(sim, cam, Lfwd, Pfwd, sim.noiserealizations, seed)
+                mc = FitVERmc(Lfwd, bnK, Phi0r, Peig, sim, cam, Fwd, P)
+                if mc is not None:
+                    dumph5("noisemc", tind2dt(cam, ti), P["outdir"], **mc)
         #%% plot results
-        goPlot(sim, Fwd, cam, Lfwd, Tm, bn, bfit, Pfwd, Pfit, Peig, Phi0, jfit, rawdata, ti, P)
+        if not plots or deferred:
+            with timer.phase("dump", ti):
+                dumpframe(sim, cam, Fwd, bn, bfit, Pfwd, Phi0, Pfit, jfit, ti, P)
+        if not plots:
+            continue
+
+        with timer.phase("plot", ti):
+            goPlot(sim, Fwd, cam, Lfwd, Tm, bn, bfit, Pfwd, Pfit, Peig, Phi0, jfit, rawdata, ti, P)
         if "animtime" in P and P["animtime"]:
             draw()
             pause(P["animtime"])
         elif "show" in P["makeplot"]:
             show()
         else:
-            close("all")
+            closeplots()  # figure templates stay open for the next frame
 
     #%% wrapup
+    if plots:
+        cleartemplates()
+    with timer.phase("flush"):
+        stopwriter()
+    closestore(runtime=time() - tic)
+    if deferred:
+        from .render import render
+
+        with timer.phase("render"):
+            render(P)
+    meta = {"cmd": P.get("cmd"), "gitrev": P.get("gitrev"), "walltime": time() - tic}
+    timer.write(P["outdir"], meta)
     msg = "{} program end".format(argv[0])
     print(msg)
     # print(msg,file=stderr)
 
 
+def runmeta(sim, cam, P):
+    """
+    run parameters stored as attributes of the results file
+    """
+    return {
+        "cmd": P.get("cmd"),
+        "gitrev": P.get("gitrev"),
+        "ini": str(P["ini"]),
+        "fitm": sim.optimfitmeth,
+        "niter": sim.optimmaxiter,
+        "camx": [C.x_km for C in cam if C.usecam],
+        "realdata": sim.realdata,
+    }
+
+
 def initPhi(Phi0, Peig, Fwd, overrides):
     try:
         if overrides["fwdguess"][0] == "maxwellian":
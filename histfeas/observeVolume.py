@@ -9,21 +9,20 @@ from numpy import (
     radians,
     append,
     diff,
-    ones,
-    outer,
     unique,
+    flatnonzero,
     ndarray,
     int64,
     int32,
 )
 import numpy as np  # need this here
-from scipy.sparse import csc_matrix
+from scipy.sparse import csc_matrix, csr_matrix, vstack
+from scipy.signal import savgol_filter
 import h5py
 from time import time
 
 #
-from .nans import nans
-from .EllLineLength import EllLineLength
+from .EllLineLength import EllLineLength, hitpixels
 
 
 def getObs(sim, cam, L, tDataInd, ver):
@@ -36,29 +35,26 @@ def getObs(sim, cam, L, tDataInd, ver):
 
     nCutPix = sim.ncutpix
 
+    used = [C for C in cam if C.usecam]
+
     if sim.realdata:
-        bn = empty(
-            nCutPix * sim.nCamUsed, dtype=float, order="F"
-        )  # FIXME assumes all cuts same length AND that cam 0 is used
-        for C in cam:
-            if not C.usecam:
-                continue
-            """
-             remember that we put "d" in lexigraphical form,
-             "d" is a column-major vector, such that if our 1D cut is N pixels,
-             HST0 occupies d(0:N-1), HST1 occupies d(N:2N-1), ...
-            """
+        """
+         remember that we put "d" in lexigraphical form,
+         "d" is a column-major vector, such that if our 1D cut is N pixels,
+         HST0 occupies d(0:N-1), HST1 occupies d(N:2N-1), ...
+         i.e. the C-order ravel of the Ncam x Npix block
+        """
+        # FIXME assumes all cuts same length
+        block = empty((len(used), nCutPix), dtype=float)
+        for k, C in enumerate(used):
             if C.keo.ndim == 2:  # more than 1 frame extracted
-                thisCamPix = C.keo[:, tDataInd]
+                block[k] = C.keo[:, tDataInd]
             elif C.keo.ndim == 1:
-                thisCamPix = C.keo
+                block[k] = C.keo
             else:
                 raise ValueError("ndim==2 or 1 for stack of 1-D extracted cut")
 
-            thisCamPix = mogrifyData(thisCamPix, C)  # for clarity
-
-            """ here's where we assemble vector of observations"""
-            bn[C.ind] = thisCamPix
+        bn = mogrifyBlock(block, used).ravel()
 
     elif ver is not None:  # or not np.any(np.isnan(v)): # no NaN in v # using synthetic data
         """ FIEFK """
@@ -66,9 +62,7 @@ def getObs(sim, cam, L, tDataInd, ver):
         bp = L.dot(ver.ravel(order="F"))
         assert bp.size == nCutPix * sim.nCamUsed
 
-        bn = nans(bp.shape)  # nans as a flag to check if something screwed up
-        for C in cam:
-            bn[C.ind] = mogrifyData(bp[C.ind], C)
+        bn = mogrifyBlock(bp.reshape(len(used), nCutPix), used).ravel()
     #%% double check
     # assert np.any(np.isnan(drn)) == False # must be AFTER all drn are assigned, or you can get false positive errors!
     if isnan(bn).any():
@@ -84,6 +78,51 @@ def getObs(sim, cam, L, tDataInd, ver):
     return bn
 
 
+def getObsBatch(sim, cam, timeInds):
+    """
+    real data: brightness vectors of many frames at once, one column per element of timeInds
+    column j is what getObs() returns for timeInds[j]: Ncam*Npix x Nframe
+    """
+    assert sim.realdata, "batch observations are extracted from real data keograms"
+
+    used = [C for C in cam if C.usecam]
+    timeInds = np.atleast_1d(timeInds)
+    # FIXME assumes all cuts same length
+    block = empty((len(used), sim.ncutpix, timeInds.size), dtype=float)
+    for k, C in enumerate(used):
+        if C.keo.ndim == 2:
+            block[k] = C.keo[:, timeInds]
+        elif C.keo.ndim == 1:
+            block[k] = C.keo[:, None]
+        else:
+            raise ValueError("ndim==2 or 1 for stack of 1-D extracted cut")
+
+    bn = mogrifyBlock(block, used).reshape(-1, timeInds.size)
+
+    bad = isnan(bn).any(axis=0)
+    if bad.any():
+        logging.critical("NaN detected at tInd = {}".format(timeInds[bad]))
+
+    return np.asfortranarray(bn)  # each column contiguous, as FitVER requires of bn
+
+
+def getObsMC(sim, cam, L, ver, K, seed=None):
+    """
+    simulation: K noisy observation vectors of one frame for Monte Carlo studies, Ncam*Npix x K
+    the noiseless projection is computed once, the same seed gives the same realizations.
+    """
+    if ver is None:
+        return
+
+    used = [C for C in cam if C.usecam]
+    bp = L.dot(ver.ravel(order="F")).reshape(len(used), sim.ncutpix)
+
+    block = np.broadcast_to(bp[..., None], bp.shape + (K,))
+    rng = np.random.default_rng(seed)
+
+    return mogrifyBlock(block, used, rng).reshape(-1, K)
+
+
 def makeCamFOVpixelEnds(Fwd, sim, cam, P):
 
     nCutPix = sim.ncutpix
@@ -111,11 +150,8 @@ def makeCamFOVpixelEnds(Fwd, sim, cam, P):
 
     # x-coordinates of corners
     # ---------------
-    # FIXME ASSUMES UNIFORM X-GRID
-    Xpc = Fwd["x"] - 0.5 * sim.fwd_dxKM  # shift left half a cell to get the corner
-    Xpc = append(
-        Xpc, Fwd["x"][-1] + 0.5 * sim.fwd_dxKM
-    )  # last column by shifting half-cell to the right
+    # from Sim.setupFwdXZ, uniform or nonuniform x-grid
+    Xpc = Fwd["xPixCorn"]
     assert Xpc.size == Fwd["x"].size + 1
     # y-coordinates of corners
     # --------------
@@ -161,7 +197,8 @@ def makeCamFOVpixelEnds(Fwd, sim, cam, P):
 def loadEll(sim, Fwd, cam, P):
     try:
         with h5py.File(str(sim.FwdLfn), "r", libver="latest") as fid:
-            L = csc_matrix(fid["/L"])
+            L = loadL(fid, sim.dtype)
+            rowoffset = fid["/Obs/camrowoffset"][()] if "/Obs/camrowoffset" in fid else None
 
             if Fwd is not None:  # we're in main program
                 if np.any(Fwd["x"] != fid["/Fwd/x"]):  # don't use .any() in case size is different
@@ -181,6 +218,9 @@ def loadEll(sim, Fwd, cam, P):
             # {x,z}PixCorn must be assigned AFTER the if/elif/else
             Fwd["xPixCorn"] = fid["/Fwd/xPixCorn"].value
             Fwd["zPixCorn"] = fid["/Fwd/zPixCorn"].value
+            # older Ell files don't have the hit pixel mask and row offsets, getEll computes them
+            Fwd["hitpix"] = fid["/Obs/hitpix"][()] if "/Obs/hitpix" in fid else None
+            Fwd["camrowoffset"] = rowoffset
 
             if cam is not None:
                 try:
@@ -211,21 +251,90 @@ def loadEll(sim, Fwd, cam, P):
 
 
 def mogrifyData(data, cam):
-    # steps should be in this order!
-    data = data.astype(float)
-    data *= cam.intens2dn  # considers pixel area and camera amplifier gain
-    data = cam.scaleintens(data)  # camera cross-calibration
+    """
+    single camera version of mogrifyBlock()
+    """
+    return mogrifyBlock(np.asarray(data)[None, ...], [cam])[0]
+
 
-    data = cam.donoise(data)
-    data = cam.dosmooth(data)
-    data = cam.dolowerthres(data)
+def mogrifyBlock(data, cam, rng=None):
+    """
+    camera gain, cross-calibration, noise, smoothing, threshold and bias applied to a whole
+    observation block at once, with per-camera parameter vectors.
 
-    data = cam.debias(data)
-    data = cam.fixnegval(data)
+    data: Ncam x Npix, or Ncam x Npix x Nframe for a batch of frames, one row per (used) camera in cam
+    steps are in the same order as the individual Cam methods, which they replace.
+    rng: numpy.random.Generator for reproducible noise, default is the global numpy.random state
+    """
+    # the one copy, everything after is in place
+    data = np.array(data, dtype=float, order="C")
+    assert data.shape[0] == len(cam), "one row of data per camera"
+    p = camparams(cam)
+    # per-camera values broadcast along pixels (and frames)
+    bc = (slice(None),) + (None,) * (data.ndim - 1)
+
+    # plotnoise() diagnostics are of one frame: not set by batches of frames or noise realizations
+    diag = data.ndim == 2
+
+    data *= (p["intens2dn"] * p["scale"])[bc]  # pixel area, amplifier gain, cross-calibration
+    #%% noise, diagnostics kept for plotnoise()
+    if (p["noiselam"] > 0).any():
+        logging.info("adding Poisson noise with lambda={} to cameras".format(p["noiselam"]))
+        poisson = np.random.poisson if rng is None else rng.poisson
+        dnoise = poisson(lam=p["noiselam"][bc], size=data.shape)
+        data += dnoise
+        for k, C in enumerate(cam):
+            if diag and p["noiselam"][k] > 0:
+                C.dnoise = dnoise[k]
+    data += p["ccdbias"][bc]
+
+    if diag:
+        for k, C in enumerate(cam):
+            C.noisy = data[k].copy()
+    #%% smoothing along the pixel axis, one call per distinct savgol setting
+    assert np.isfinite(data).all(), "NaN leaked into brightness data, savgol cannot handle NaN"
+    for span, order in unique(p["savgol"], axis=0):
+        if span > 0 and order > 0:
+            k = (p["savgol"] == (span, order)).all(axis=1)
+            data[k] = savgol_filter(data[k], span, order, axis=1)
+
+    data[data < p["lowerthres"][bc]] = 0
+
+    data -= p["debias"][bc]
+    np.maximum(data, 0, out=data)
 
     return data
 
 
+def camparams(cam):
+    """
+    per-camera observation parameters of mogrifyBlock() as vectors, unset parameters are no-ops
+    """
+
+    def getpar(name, unset):
+        val = []
+        for C in cam:
+            v = getattr(C, name, None)
+            try:
+                val.append(float(v) if v is not None and np.isfinite(v) else unset)
+            except TypeError:
+                val.append(unset)
+
+        return np.array(val, dtype=float)
+
+    savgol = np.column_stack((getpar("smoothspan", 0), getpar("savgolOrder", 0))).astype(int)
+
+    return {
+        "intens2dn": getpar("intens2dn", 1.0),
+        "scale": getpar("intensityScaleFactor", 1.0),
+        "noiselam": getpar("noiselam", 0.0),
+        "ccdbias": getpar("ccdbias", 0.0),
+        "savgol": savgol,
+        "lowerthres": getpar("lowerthres", -np.inf),
+        "debias": getpar("debiasData", 0.0),
+    }
+
+
 def getEll(sim, cam, Fwd, P):
 
     if not sim.loadfwdL:
@@ -236,28 +345,142 @@ def getEll(sim, cam, Fwd, P):
     else:
         L, Fwd, cam = loadEll(sim, Fwd, cam, P)
 
-    L = removeUnusedCamera(L, sim.useCamBool, sim.ncutpix)
+    L = csr_matrix(L, dtype=sim.dtype)
+    #%% used cameras are contiguous row blocks of the CSR L
+    offset = Fwd.get("camrowoffset")
+    if offset is None:
+        offset = np.arange(sim.useCamBool.size + 1) * sim.ncutpix
+    spans = camrows(sim.useCamBool, offset)
+    nrow = L.shape[0]
+    L = selectrows(L, spans)
+    #%% pixels whose ray crosses the grid, stored in the Ell file
+    hit = Fwd.get("hitpix")
+    if hit is not None and hit.size == nrow:
+        Fwd["hitpix"] = np.concatenate([hit[a:b] for a, b in spans])
+    else:
+        Fwd["hitpix"] = hitpixels(L)
+    # row of the full b vector for each row kept when the solver drops non-intersecting rows
+    Fwd["hitrows"] = flatnonzero(Fwd["hitpix"])
 
-    cam = definecamind(cam, L)
+    cam = definecamind(cam, L, Fwd["hitpix"])
 
     assert "x" in Fwd and Fwd["x"] is not None, "problem loading or computing grid"
+    #%% voxels no used camera sees can't be estimated, the inversion leaves them out
+    Fwd["voxobs"] = observedvoxels(L)
+    logging.info(
+        "{} of {} grid voxels are observed by the used cameras".format(
+            Fwd["voxobs"].sum(), Fwd["voxobs"].size
+        )
+    )
 
     return L, Fwd, cam
 
 
+def observedvoxels(L):
+    """
+    boolean mask of the columns of L (grid voxels, column-major sz x sx) crossed by any pixel ray
+    """
+    return diff(csc_matrix(L).indptr) > 0
+
+
 def removeUnusedCamera(L, useCamBool, ncutpix):
     """
     remove unused cameras (rows of L)
     we DO NOT trim out non-intersecting rows of used cameras--that's why the matrix is sparse,
     no computational impact or extra bookkeeping.
     """
-    arow = ones(ncutpix, bool)
-    grow = outer(arow, useCamBool).ravel(order="F")
+    offset = np.arange(useCamBool.size + 1) * ncutpix
+
+    return selectrows(L, camrows(useCamBool, offset))
+
+
+def loadhit(sim):
+    """
+    hit pixel mask of the used cameras, concatenated as the rows of the L used by doSim.
+    Reads only the small per-camera index datasets of the Ell file, not L itself.
+    """
+    with h5py.File(str(sim.FwdLfn), "r", libver="latest") as fid:
+        if "/Obs/camrowoffset" in fid:
+            offset = fid["/Obs/camrowoffset"][()]
+        else:
+            offset = np.arange(sim.useCamBool.size + 1) * sim.ncutpix
+
+        if "/Obs/hitind" in fid:
+            hit = []
+            for i in flatnonzero(sim.useCamBool):
+                h = np.zeros(offset[i + 1] - offset[i], dtype=bool)
+                h[fid[f"/Obs/hitind/{i}"][()]] = True
+                hit.append(h)
+            return np.concatenate(hit)
+
+        spans = camrows(sim.useCamBool, offset)
+        if "/Obs/hitpix" in fid:  # older Ell file, whole-L mask
+            hit = fid["/Obs/hitpix"][()]
+            return np.concatenate([hit[a:b] for a, b in spans])
+
+        logging.info(f"{sim.FwdLfn} has no hit pixel index, reading L")
+        L = loadL(fid)
+
+    return hitpixels(selectrows(L, spans))
+
+
+def camrows(useCamBool, offset):
+    """
+    (first, last+1) rows of L for each used camera, adjacent cameras merged into one span
+    offset: first row of each camera, and the total number of rows
+    """
+    spans = []
+    for i in flatnonzero(useCamBool):
+        a, b = int(offset[i]), int(offset[i + 1])
+        if spans and spans[-1][1] == a:
+            spans[-1] = (spans[-1][0], b)
+        else:
+            spans.append((a, b))
+
+    return spans
+
+
+def selectrows(L, spans):
+    """
+    rows of CSR L in spans. A single span (e.g. all cameras, or adjacent ones) shares the
+    data and indices arrays of L, only indptr is shifted.
+    """
+    L = csr_matrix(L)
+
+    blocks = []
+    for a, b in spans:
+        p0, p1 = L.indptr[a], L.indptr[b]
+        blocks.append(
+            csr_matrix(
+                (L.data[p0:p1], L.indices[p0:p1], L.indptr[a : b + 1] - p0),
+                shape=(b - a, L.shape[1]),
+                copy=False,
+            )
+        )
 
-    return L[grow, :]
+    return blocks[0] if len(blocks) == 1 else vstack(blocks, format="csr")
 
 
-def definecamind(cam, L):
+def loadL(fid, dtype=None):
+    """
+    L from an open Ell file: the CSR /L/{data,indices,indptr}, or a legacy dense /L
+    dtype: convert to this dtype, default is as stored
+    """
+    h = fid["/L"]
+    if isinstance(h, h5py.Group):
+        stored = h["data"].dtype
+        if dtype is not None and np.dtype(dtype).itemsize > stored.itemsize:
+            logging.warning(
+                f"{fid.filename} stores L in {stored}, less precise than {np.dtype(dtype)}."
+                " Recompute it with -L"
+            )
+        data = h["data"][()].astype(dtype or stored, copy=False)
+        return csr_matrix((data, h["indices"][()], h["indptr"][()]), shape=tuple(h.attrs["shape"]))
+
+    return csr_matrix(h[()], dtype=dtype)
+
+
+def definecamind(cam, L, hit=None):
     """
     store indices of b vector corresponding to each camera (in case some cameras not used)
     even if we didn't eliminate them, they wouldn't be used in computation (that's what L sparse matrix is for)
@@ -270,7 +493,12 @@ def definecamind(cam, L):
     --------------
     we do NOT use enumerate in order to account for prior function deleting unused cameras in the middle.
     e.g. cam0,2 used, cam1 not used
+
+    hit: boolean mask of the rows of L that intersect the grid (from the Ell file), else computed here.
+    L is not needed when hit is given.
     """
+    if hit is None:
+        hit = hitpixels(L)
     # TODO assumes all C.ncutpix are equal
     i = 0
     for C in cam:
@@ -283,9 +511,9 @@ def definecamind(cam, L):
             """
             C.ind = slice(i * C.ncutpix, (i + 1) * C.ncutpix)
             """
-            i*ncutpix + unique() is needed since we can't compute in advance (uneven numbers of hits)
+            i*ncutpix + hit pixels is needed since we can't compute in advance (uneven numbers of hits)
             """
-            Lcind = unique(L[C.ind, :].nonzero()[0])
+            Lcind = flatnonzero(hit[C.ind])
             C.Lcind = ind2slice(Lcind)  # for this camera angle_deg
 
             C.Lind = ind2slice(i * C.ncutpix + Lcind)  # for braw, best
@@ -307,4 +535,4 @@ def ind2slice(ind):
         diff(ind) == 1
     ).all(), "only sequential integers for now. Other uniform steps are possible with slight modification"
 
-    return slice(ind[0], ind[-1])
+    return slice(ind[0], ind[-1] + 1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+location (B_perp, E_0) of the peak of differential number flux, without plotting imports
+
+fast: log-parabola through the peak and its neighbors along energy and B_perp, for any
+      number of frames at once (default)
+gaussian: iterative 2-D gaussian fit near the peak (gaussfitter), one frame at a time
+"""
+import logging
+from numpy import (
+    arange,
+    asarray,
+    clip,
+    empty,
+    errstate,
+    isfinite,
+    linspace,
+    log,
+    nan,
+    unravel_index,
+    where,
+)
+from scipy.interpolate import interp1d
+
+ESTIMATORS = ("fast", "gaussian")
+
+
+def peakx0E0(Phifwd, Phifit, E, x, E0min, method="fast"):
+    """
+    (x0, E0) of [Phifwd, Phifit] (Nenergy x Nx, either may be None) by method.
+    gfit, the intermediate arrays for plotsnew.plotgfit(), is None for the fast method.
+    """
+    if method == "gaussian":
+        return gaussx0E0(Phifwd, Phifit, E, x, E0min)
+    elif method != "fast":
+        raise ValueError(f"peak estimator must be one of {ESTIMATORS}, not {method}")
+
+    gx0 = empty(2)
+    gE0 = empty(2)
+    for i, p in enumerate((Phifwd, Phifit)):
+        gx0[i], gE0[i] = (nan, nan) if p is None else fastx0E0(p, E, x, E0min)
+
+    return gx0, gE0, None
+
+
+def peaks(Phi, E, x, E0min, method="fast"):
+    """
+    (x0, E0) of each frame of flux Phi: Nenergy x Nx x Ntime, by method
+    """
+    if method == "fast":
+        return fastx0E0(Phi, E, x, E0min)
+    elif method != "gaussian":
+        raise ValueError(f"peak estimator must be one of {ESTIMATORS}, not {method}")
+
+    nt = Phi.shape[-1]
+    x0 = empty(nt)
+    E0 = empty(nt)
+    for i in range(nt):
+        gx0, gE0, _ = gaussx0E0(Phi[..., i], None, E, x, E0min)
+        x0[i], E0[i] = gx0[0], gE0[0]
+
+    return x0, E0
+
+
+def fastx0E0(Phi, E, x, E0min):
+    """
+    peak (x0, E0) of flux Phi: Nenergy x Nx [x Ntime], all frames at once.
+
+    Energy and B_perp of the largest flux are refined between grid points by the vertex of
+    the parabola through the log of the peak and its two neighbors along each axis, exact for
+    a gaussian peak also on the nonuniform energy grid. Where a neighbor is not positive,
+    the flux-weighted centroid of the three points is used instead.
+    Peaks on the edge of the grid are not refined.
+    """
+    Phi = asarray(Phi, dtype=float)
+    E = asarray(E, dtype=float)
+    x = asarray(x, dtype=float)
+    single = Phi.ndim == 2
+    if single:
+        Phi = Phi[..., None]
+
+    nE, nx, nt = Phi.shape
+    Phi = where((E < E0min)[:, None, None], 0.0, Phi)
+
+    flat = Phi.reshape(nE * nx, nt)
+    flat = where(isfinite(flat), flat, -1.0)
+    ok = (flat > 0).any(axis=0)
+    row, col = unravel_index(flat.argmax(axis=0), (nE, nx))
+    t = arange(nt)
+    rlo, rhi = clip(row - 1, 0, nE - 1), clip(row + 1, 0, nE - 1)
+    clo, chi = clip(col - 1, 0, nx - 1), clip(col + 1, 0, nx - 1)
+    mid = Phi[row, col, t]
+
+    E0 = vertex(E, row, Phi[rlo, col, t], mid, Phi[rhi, col, t])
+    x0 = vertex(x, col, Phi[row, clo, t], mid, Phi[row, chi, t])
+
+    E0 = where(ok, E0, nan)
+    x0 = where(ok, x0, nan)
+
+    return (x0[0], E0[0]) if single else (x0, E0)
+
+
+def vertex(u, i, flo, fmid, fhi):
+    """
+    peak location on grid u near index i, from the values at i-1, i, i+1
+    """
+    n = u.size
+    edge = (i == 0) | (i == n - 1)
+    a, b, c = u[clip(i - 1, 0, n - 1)], u[i], u[clip(i + 1, 0, n - 1)]
+
+    with errstate(divide="ignore", invalid="ignore"):
+        la, lb, lc = log(flo), log(fmid), log(fhi)
+        num = (b - a) ** 2 * (lb - lc) - (b - c) ** 2 * (lb - la)
+        den = (b - a) * (lb - lc) - (b - c) * (lb - la)
+        par = b - 0.5 * num / den
+        cen = (a * flo + b * fmid + c * fhi) / (flo + fmid + fhi)
+
+    good = (flo > 0) & (fhi > 0) & (den != 0)
+    v = where(good, par, where((flo >= 0) & (fhi >= 0), cen, b))
+
+    return where(edge, b, clip(v, a, c))
+
+
+def gaussx0E0(Phifwd, Phifit, E, x, E0min):
+    """
+    2-D gaussian fit near the peak of Phifwd and Phifit (Nenergy x Nx, either may be None)
+
+    returns (x0, E0) of [Phifwd, Phifit] and the intermediate arrays used by plotsnew.plotgfit()
+    """
+    from gaussfitter import gaussfit, twodgaussian  # only needed here
+
+    Npts = 200
+    Nptsfits = (Npts // 40, Npts // 20)  # (nEnergyToUse+-, nXtouse+-)
+
+    def clipPhi(fwd, fit, E):
+        Elin = linspace(E[0], E[-1], Npts)
+
+        try:
+            phifwd = fwd.copy()
+            phifwd[E < E0min, :] = 0.0
+            f = interp1d(E, phifwd, kind="linear", axis=0)
+            fwdlin = f(Elin)
+        except AttributeError:
+            fwdlin = None
+
+        try:
+            phifit = fit.copy()
+            phifit[E < E0min, :] = 0.0
+            f = interp1d(E, phifit, kind="linear", axis=0)
+            fitlin = f(Elin)
+        except AttributeError:
+            fitlin = None
+
+        return fwdlin, fitlin, Elin
+
+    cPhifwd, cPhifit, Elin = clipPhi(Phifwd, Phifit, E)
+    #%% first guess of 2-D peak, take region of pixels near the peak to fit
+    # note that unravel_index for jf must be order='C'
+    def gfitphi(Philin, Elin):
+        if Philin is None:
+            return nan, nan, None, None
+
+        pkrow, pkcol = unravel_index(Philin.argmax(axis=None), Philin.shape, order="C")
+        nh = Nptsfits  # MxN region to extract
+        rcpluck = pkrow - nh[0], pkcol - nh[1]
+        gpeak = Philin[rcpluck[0] : pkrow + nh[0], rcpluck[1] : pkcol + nh[1]]
+        # set_trace()
+        try:
+            gparam = gaussfit(gpeak, returnfitimage=False)
+        except ValueError:
+            logging.error(
+                "gaussian fit peak against edge of model space."
+                "gpix shape {} row {} col {}".format(gpeak.shape, pkrow, pkcol)
+            )
+            return nan, nan, None, None
+
+        Ghcol = int(round(gparam[2] + rcpluck[1]))
+        Ghrow = int(round(gparam[3] + rcpluck[0])) + 1  # altitude of peak
+
+        gparamshift = gparam.copy()
+        gparamshift[2] = gparam[2] + rcpluck[1]
+        gparamshift[3] = gparam[3] + rcpluck[0]
+        gpix = twodgaussian(gparamshift, shape=Philin.shape)
+
+        try:
+            return x[Ghcol], Elin[Ghrow], gpix, gpeak
+        except IndexError:
+            logging.error("gaussian fit was outside model space")
+            return nan, nan, None, None
+
+    gx0 = empty(2)
+    gE0 = empty(2)
+    gpix = []
+    gpeak = []
+    for i, p in enumerate((cPhifwd, cPhifit)):
+        gx0[i], gE0[i], gp, gk = gfitphi(p, Elin)
+        gpix.append(gp)
+        gpeak.append(gk)
+
+    gfit = {"Elin": Elin, "phifwd": cPhifwd, "phifit": cPhifit, "gpix": gpix, "gpeak": gpeak}
+
+    return gx0, gE0, gfit
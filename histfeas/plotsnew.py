@@ -1,5 +1,7 @@
 from pathlib import Path
+import os
 import logging
+from weakref import WeakKeyDictionary
 from numpy import (
     s_,
     array,
@@ -13,8 +15,6 @@ from numpy import (
     cos,
     pi,
     ones_like,
-    nan,
-    unravel_index,
     meshgrid,
     logspace,
     log10,
@@ -22,18 +22,19 @@ from numpy import (
     atleast_2d,
     ndarray,
 )
-from datetime import datetime
 
 # from numpy.ma import masked_invalid #for pcolormesh, which doesn't like NaN
-from matplotlib.pyplot import figure, subplots, text, colorbar
+from matplotlib.pyplot import figure, subplots, text, colorbar, close, get_fignums
+from matplotlib.image import imsave
 from matplotlib.colors import LogNorm
+from matplotlib.cm import ScalarMappable
+from matplotlib.axes import Axes
 from matplotlib.ticker import (
     LogFormatterMathtext,
     MultipleLocator,
     ScalarFormatter,
 )  # for 1e4 -> 1 x 10^4, applied DIRECTLY in format=
 import h5py
-from scipy.interpolate import interp1d
 from xarray import DataArray
 
 #
@@ -45,17 +46,20 @@ try:
     from plotly.graph_objs import Data, Figure, XAxis, YAxis, Contour, Layout
 except ImportError:
     plotly = None
-#
-try:
-    from gaussfitter import gaussfit, twodgaussian
-except Exception as e:
-    gaussfitter = None
+if os.name == "nt":  # as gridaurora.plots
+    import pathvalidate
+else:
+    pathvalidate = None
 #
 from sciencedates import find_nearest
 from histutils.plotsimul import plotRealImg, plotPlainImg
 from gridaurora.opticalmod import plotOptMod
-from gridaurora.plots import ploteigver, writeplots, nametime
+from gridaurora.plots import ploteigver, writeplots as writefig
 from .io import planviewkml
+from .results import dumph5, tind2dt, nametime
+from .peakest import gaussx0E0, peakx0E0
+from .render import FIGURES
+from . import writer
 
 #%% plot globals
 longtitle = False
@@ -69,6 +73,164 @@ pstyle = "contour"
 
 phi1dmax = 5e5
 
+#%% figure templates
+# P['templates']: each figure is built on the first frame and reused for the following frames,
+# only the data of its QuadMesh and Line2D artists is updated
+_templates = {}  # figure name: (Figure, Axes) or (Figure, 2-D array of Axes)
+_artists = WeakKeyDictionary()  # Axes or Figure: {key: artist(s) updated each frame}
+_crops = WeakKeyDictionary()  # Figure: PNG crop of the first frame, all frames the same size
+_backgrounds = WeakKeyDictionary()  # Figure: (layout state, rendered background)
+
+
+#%%
+def writeplots(fg, plotprefix, tind=None, odir=None, fmt=".png", doclose=True, **kwargs):
+    """
+    gridaurora.plots.writeplots(). With the background writer running, the figure is rendered
+    here (matplotlib is not thread safe) and the PNG encoding and disk write are queued.
+    Figure templates (doclose=False) are rendered the same way and kept open, with the crop of
+    their first frame.
+    Vector formats are written directly.
+    """
+    if fmt != ".png" or kwargs or (doclose and not writer.running()):
+        return writefig(fg, plotprefix, tind, odir, fmt, doclose=doclose, **kwargs)
+
+    if fg is None or odir is None:
+        return
+
+    try:
+        if doclose:
+            fg.canvas.draw()
+        else:
+            drawtemplate(fg)
+        img = array(fg.canvas.buffer_rgba())
+        # crop as savefig(bbox_inches='tight')
+        bb = _crops.get(fg)
+        if bb is None:
+            bb = fg.get_tightbbox(fg.canvas.get_renderer()).padded(0.1)
+            if not doclose:
+                _crops[fg] = bb
+        H, W = img.shape[:2]
+        r0, r1 = int(H - bb.y1 * fg.dpi), int(H - bb.y0 * fg.dpi + 0.5)
+        c0, c1 = int(bb.x0 * fg.dpi), int(bb.x1 * fg.dpi + 0.5)
+        img = img[max(r0, 0) : min(r1, H), max(c0, 0) : min(c1, W)]
+
+        fn = plotprefix + nametime(tind) + fmt
+        if pathvalidate is not None:
+            fn = pathvalidate.sanitize_filename(fn)
+        fn = Path(odir).expanduser() / fn
+        print("write", fn)
+        if doclose:
+            close(fg)
+    except Exception as e:
+        logging.error(f"{e}  when plotting {plotprefix}")
+        return
+
+    writer.submit(imsave, fn, img)  # now, if the writer isn't running
+
+
+def drawtemplate(fg):
+    """
+    render a figure template. While the axes limits, titles and color limits stay the same,
+    the background (axes, ticks, labels, colorbars) is rendered once, and each frame
+    only the updated meshes and lines, the legends and the suptitle are drawn on it.
+    """
+    dyn = []
+    for a in [fg] + fg.axes:
+        for v in _artists.get(a, {}).values():
+            dyn += [h for h in (v if isinstance(v, list) else [v]) if not isinstance(h, Axes)]
+    dyn += [ax.get_legend() for ax in fg.axes if ax.get_legend() is not None]
+
+    state = [fg.dpi, tuple(fg.get_size_inches())]
+    for ax in fg.axes:
+        state += [ax.viewLim.bounds, ax.get_title()]
+    state += [h.get_clim() for h in dyn if isinstance(h, ScalarMappable)]
+
+    bg = _backgrounds.get(fg)
+    if bg is None or bg[0] != state:
+        for h in dyn:
+            h.set_animated(True)  # not drawn by canvas.draw()
+        fg.canvas.draw()
+        _backgrounds[fg] = state, fg.canvas.copy_from_bbox(fg.bbox)
+        for h in dyn:
+            h.set_animated(False)  # for show() and savefig()
+    else:
+        fg.canvas.restore_region(bg[1])
+
+    for h in dyn:
+        fg.draw_artist(h)
+
+
+def template(P, ax):
+    """
+    figure templates: dict of the artists of ax (Axes or Figure) updated each frame,
+    None if not in use
+    """
+    if not P.get("templates") or ax is None:
+        return None
+
+    return _artists.setdefault(ax, {})
+
+
+def linedrawer(P, ax, key):
+    """
+    draw(plot, x, y, **kwargs) calls e.g. plot=ax.semilogx.
+    With figure templates, on later frames the lines of the first frame take the new x, y
+    in the order they were drawn. reuse: the lines already exist.
+    """
+    tpl = template(P, ax)
+    if tpl is not None and key in tpl:
+        old = iter(tpl[key])
+
+        def draw(plot, x, y, **kwargs):
+            next(old).set_data(x, y)
+
+        return draw, True
+
+    new = []
+    if tpl is not None:
+        tpl[key] = new
+
+    def draw(plot, x, y, **kwargs):
+        new.extend(plot(x, y, **kwargs))
+
+    return draw, False
+
+
+def subplotfig(P, name, nrow, ncol, **kwargs):
+    """
+    subplots(), or with figure templates the figure of the previous frame.
+    returns fg, axs (2-D), new
+    """
+    name = f"{name}{nrow}x{ncol}"
+    if P.get("templates") and name in _templates:
+        return _templates[name] + (False,)
+
+    fg, axs = subplots(nrow, ncol, **kwargs)
+    axs = atleast_2d(axs)
+    if P.get("templates"):
+        _templates[name] = fg, axs
+
+    return fg, axs, True
+
+
+def closeplots():
+    """
+    close("all"), except the figure templates
+    """
+    keep = [t[0] for t in _templates.values()]
+    for n in get_fignums():
+        fg = figure(n)
+        if fg not in keep:
+            close(fg)
+
+
+def cleartemplates():
+    for fg, _ in _templates.values():
+        close(fg)
+
+    _templates.clear()
+
+
 #%%
 def logfmt(makeplot, powlim=(-2, 2)):
     """
@@ -105,6 +267,8 @@ def placetxt(x, y, txt, ax):
 
 def goPlot(sim, Fwd, cam, Lfwd, Tm, drn, dhat, ver, vfit, Peig, Phi0, Phifit, rawdata, tInd, P):
     makeplot = P["makeplot"]
+    # --defer-plots: these are rendered by render.py from results.h5 after the run
+    deferred = FIGURES if P.get("deferplots", False) else ()
     #%% nicer file naming
     T = tind2dt(cam, tInd)
     #%% convenience
@@ -214,7 +378,7 @@ def goPlot(sim, Fwd, cam, Lfwd, Tm, drn, dhat, ver, vfit, Peig, Phi0, Phifit, ra
     if not sim.realdata and ("fwd" in makeplot or "optim" in makeplot):
         plotnoise(cam, T, P, "bnoise")
 
-    if "fwd" in makeplot:
+    if "fwd" in makeplot and "fwd" not in deferred:
         plotfwd(sim, cam, drn, xKM, xp, zKM, zp, ver, Phi0, Phifit, tInd, P)
     #%% gaussian fit of optim
     if "gaussian" in makeplot and "fwd" in makeplot:
@@ -253,10 +417,13 @@ def goPlot(sim, Fwd, cam, Lfwd, Tm, drn, dhat, ver, vfit, Peig, Phi0, Phifit, ra
             1810,
         )
     #%% optimize search plots
-    if "optim" in makeplot:
+    if "optim" in makeplot and "optim" not in deferred:
         plotoptim(
             sim, cam, drn, dhat, bcomptxt, ver, Phi0, vfit, Phifit, xKM, xp, zKM, zp, tInd, P
         )
+    #%% peak regions and gaussian fits, forward and estimated flux
+    if "gfit" in makeplot and Phifit is not None and Phifit["x"] is not None:
+        plotpeak(Phi0, Phifit, xKM, sim, tInd, P)
     #%% maximum entropy
     if "phimaxent" in makeplot:
         plotJ(
@@ -362,20 +529,6 @@ def goPlot(sim, Fwd, cam, Lfwd, Tm, drn, dhat, ver, vfit, Peig, Phi0, Phifit, ra
         plotBcompare(sim, drn, dhat["fit_art"], cam, sim.nCamUsed, "bart", tInd, P)
 
 
-def tind2dt(cam, tind):
-    # NOTE: the [:-3] is arbitrary to keep 3 digits right of the decimal.
-
-    try:  # first run
-        return datetime.utcfromtimestamp(cam[0].tKeo[tind]).isoformat()[:-3]
-    except IndexError:  # loading data
-        return datetime.utcfromtimestamp(cam[0].tKeo).isoformat()[:-3]
-    except (
-        AttributeError,
-        OSError,
-    ):  # simdata  #OSError thrown when nan fed into utcfromtimestamp
-        return str(tind)
-
-
 #%%
 def plotfwd(sim, cam, drn, xKM, xp, zKM, zp, ver, Phi0, fitp, tInd, P, doSubplots=True):
     assert isinstance(P, dict)
@@ -389,14 +542,22 @@ def plotfwd(sim, cam, drn, xKM, xp, zKM, zp, ver, Phi0, fitp, tInd, P, doSubplot
 
     if doSubplots:
         ttxt = T + f"\n x_cam {getcamx(cam)}"
-        fg, axs = subplots(nrow, ncol, figsize=(ncol * 7.5, nrow * 7.5))
-        axs = atleast_2d(axs)
-
-        fg.suptitle(ttxt)  # FIXME here we just use the fastest camera, cam 0 apriori
-        fg.subplots_adjust(top=0.9)  # FIXME http://matplotlib.org/faq/howto_faq.html
-        fg.text(
-            1.0, 1.0, plotstamp(sim, P), ha="right", va="top", rotation="vertical", size="small"
-        )
+        fg, axs, new = subplotfig(P, "fwd", nrow, ncol, figsize=(ncol * 7.5, nrow * 7.5))
+
+        st = fg.suptitle(ttxt)  # FIXME here we just use the fastest camera, cam 0 apriori
+        if P.get("templates"):
+            template(P, fg)["suptitle"] = st
+        if new:
+            fg.subplots_adjust(top=0.9)  # FIXME http://matplotlib.org/faq/howto_faq.html
+            fg.text(
+                1.0,
+                1.0,
+                plotstamp(sim, P),
+                ha="right",
+                va="top",
+                rotation="vertical",
+                size="small",
+            )
     else:
         axs = array([(None,) * nrow, (None,) * ncol])
 
@@ -465,8 +626,12 @@ def plotfwd(sim, cam, drn, xKM, xp, zKM, zp, ver, Phi0, fitp, tInd, P, doSubplot
     #        plotRealImg(sim,cam,rawdata,tInd,makeplot,odir=odir)
 
     if doSubplots:
-        closetight(fg, axs)
-        writeplots(fg, "fwd", T, P["outdir"], fmt=".svg")
+        if new:
+            closetight(fg, axs)
+        if P.get("templates"):  # a PNG frame sequence
+            writeplots(fg, "fwd", T, P["outdir"], doclose=False)
+        else:
+            writeplots(fg, "fwd", T, P["outdir"], fmt=".svg")
 
 
 def plotstamp(sim, P):
@@ -506,12 +671,14 @@ def plotoptim(
 
     if doSubplots:
         ttxt = T + f"\n x_cam {getcamx(cam)}"
-        fg, axs = subplots(nrow, 3, figsize=(21, nrow * 7.5))
-        axs = atleast_2d(axs)
+        fg, axs, new = subplotfig(P, "est", nrow, 3, figsize=(21, nrow * 7.5))
 
-        fg.suptitle(ttxt)  # FIXME here we just use the fastest camera, cam 0 apriori
+        st = fg.suptitle(ttxt)  # FIXME here we just use the fastest camera, cam 0 apriori
+        if P.get("templates"):
+            template(P, fg)["suptitle"] = st
         # fg.subplots_adjust(top=0.95) # FIXME http://matplotlib.org/faq/howto_faq.html
-        fg.text(1.0, 1.0, plotstamp(sim, P), ha="right", va="top", rotation="vertical")
+        if new:
+            fg.text(1.0, 1.0, plotstamp(sim, P), ha="right", va="top", rotation="vertical")
     else:
         axs = array([(None,) * 3, (None,) * 3])
 
@@ -596,8 +763,12 @@ def plotoptim(
     # http://stackoverflow.com/questions/2176424/hiding-axis-text-in-matplotlib-plots
 
     if doSubplots:
-        closetight(fg, axs)
-        writeplots(fg, "est", T, P["outdir"], fmt=".svg")
+        if new:
+            closetight(fg, axs)
+        if P.get("templates"):  # a PNG frame sequence
+            writeplots(fg, "est", T, P["outdir"], doclose=False)
+        else:
+            writeplots(fg, "est", T, P["outdir"], fmt=".svg")
 
 
 def closetight(fg, axs):
@@ -726,7 +897,8 @@ def plotPicard(A, b, cvar=None):
 def plotJ1D(sim, PhiFwd, PhiInv, Ek, xlbl, T, P, prefix, titletxt, ax=None):
     assert isinstance(P, dict)
 
-    fg, ax = fighandler(ax)
+    fg, ax = fighandler(ax, P, prefix)
+    draw, reuse = linedrawer(P, ax, prefix)
 
     lfwd = "$\Phi|x=$"
     linv = "$\hat{\Phi}|x=$"
@@ -738,15 +910,16 @@ def plotJ1D(sim, PhiFwd, PhiInv, Ek, xlbl, T, P, prefix, titletxt, ax=None):
 
             try:
                 if Phi.ndim == 1:
-                    ax.loglog(Ek, Phi, marker=".", label=l + str(xlbl[0]))  # xlbl[0], not .item()
-                    if P["verbose"]:
+                    # xlbl[0], not .item()
+                    draw(ax.loglog, Ek, Phi, marker=".", label=l + str(xlbl[0]))
+                    if P["verbose"] and not reuse:
                         labelpeakE(Phi, Ek, sim.minenergy, ax)
                 else:
                     assert Phi.shape[1] == len(xlbl)
                     for i in range(Phi.shape[1]):
-                        ax.loglog(Ek, Phi[:, i], marker=".", label=l + str(xlbl[i]))
+                        draw(ax.loglog, Ek, Phi[:, i], marker=".", label=l + str(xlbl[i]))
 
-                        if P["verbose"]:
+                        if P["verbose"] and not reuse:
                             labelpeakE(Phi[:, i], Ek, sim.minenergy, ax)
 
             except ValueError as e:
@@ -755,22 +928,25 @@ def plotJ1D(sim, PhiFwd, PhiInv, Ek, xlbl, T, P, prefix, titletxt, ax=None):
                     "\n did you pick the correct --x1d ?   {}".format(T, titletxt, e)
                 )
 
-    ax.grid(True, "both")
+    if reuse:  # figure template: limits from the new data, as on a new figure
+        ax.relim()
     ax.autoscale(True, tight=False)
     ax.set_ylim(P["vlim"]["j1d"])
     ax.set_xlim([Ek[0] * 0.98, Ek[-1] * 1.05])
-
-    ax.set_xlabel("particle energy [eV]")
-    ax.set_ylabel("Differential Number Flux  [cm$^{-2}$s$^{-1}$eV$^{-1}$]")
     ax.set_title(titletxt)
-    ax.legend(loc="upper right")
 
-    ax.tick_params(axis="both", which="both")
+    if not reuse:
+        ax.grid(True, "both")
+        ax.set_xlabel("particle energy [eV]")
+        ax.set_ylabel("Differential Number Flux  [cm$^{-2}$s$^{-1}$eV$^{-1}$]")
+        ax.legend(loc="upper right")
 
-    if P["verbose"]:
-        ax.legend(loc="lower left")
+        ax.tick_params(axis="both", which="both")
 
-    writeplots(fg, prefix, T, P["outdir"])
+        if P["verbose"]:
+            ax.legend(loc="lower left")
+
+    writeplots(fg, prefix, T, P["outdir"], doclose=not P.get("templates"))
 
     dumph5(prefix, T, P["outdir"], PhiFwd1d=PhiFwd, PhiInv1d=PhiInv, Ek=Ek)
 
@@ -821,9 +997,18 @@ def plotJ(sim, Jflux, x, xp, Ek, EKpcolor, T, P, prefix, titletxt, ax=None):
             py.plot(dfg, filename="{}_{}_{}".format(P["outdir"], prefix, T), auto_open=False)
         else:
 
-            fg, ax = fighandler(ax)
+            fg, ax = fighandler(ax, P, prefix + p)
+            tpl = template(P, ax)
+            if tpl is not None and p in tpl:  # figure template: new data, same layout
+                tpl[p].set_array(Jflux)
+                tpl[p].set_clim(vmin, vmax)
+                ax.set_title(titletxt)
+                writeplots(fg, prefix + p, T, P["outdir"], doclose=False)
+                continue
+            # contours can't be updated in place, figure templates use pcolormesh
+            style = "pcolor" if tpl is not None else pstyle
 
-            if pstyle == "pcolor":
+            if style == "pcolor":
                 hc = ax.pcolormesh(
                     xp,
                     EKpcolor,
@@ -835,7 +1020,7 @@ def plotJ(sim, Jflux, x, xp, Ek, EKpcolor, T, P, prefix, titletxt, ax=None):
                     vmax=vmax,
                 )  # vmin can't be 0 when using LogNorm!
                 # my recollection is that rasterized=True didn't really help savefig speed
-            elif pstyle == "contour":
+            elif style == "contour":
                 if vmin and vmax:
                     clvl = logspace(log10(vmin), log10(vmax), 6)
                 else:
@@ -857,7 +1042,7 @@ def plotJ(sim, Jflux, x, xp, Ek, EKpcolor, T, P, prefix, titletxt, ax=None):
             # now let's fix the exponent label on the colorbar
             #           cbar.ax.yaxis.get_offset_text().set_size(afs)
             cbar.ax.yaxis.get_offset_text().set_position((2, 10))
-            if pstyle == "contour":
+            if style == "contour":
                 cbar.add_lines(hc)
 
             ax.set_yscale("log")
@@ -868,7 +1053,9 @@ def plotJ(sim, Jflux, x, xp, Ek, EKpcolor, T, P, prefix, titletxt, ax=None):
 
             _doJlbl(fg, ax, titletxt)
 
-            writeplots(fg, prefix + p, T, P["outdir"])
+            if tpl is not None:
+                tpl[p] = hc
+            writeplots(fg, prefix + p, T, P["outdir"], doclose=tpl is None)
 
     #%% 3-D
     if "3d" in P["makeplot"]:
@@ -939,7 +1126,8 @@ def getmin(vs, vu):
 def plotVER1D(sim, pfwd, pinv, zKM, xlbl, T, P, prefix="", titletxt="", ax=None):
     assert isinstance(P, dict)
 
-    fg, ax = fighandler(ax)
+    fg, ax = fighandler(ax, P, prefix)
+    draw, reuse = linedrawer(P, ax, prefix)
 
     lfwd = "$\mathbf{P}|x=$"
     linv = "$\hat{\mathbf{P}}|x=$"
@@ -954,33 +1142,37 @@ def plotVER1D(sim, pfwd, pinv, zKM, xlbl, T, P, prefix="", titletxt="", ax=None)
                 list comprehension goofed up escapes, what a mess.
                 """
                 if p.ndim == 1:
-                    ax.semilogx(p, zKM, label=l + str(xlbl[0]))  # xlbl[0], not .item()
+                    draw(ax.semilogx, p, zKM, label=l + str(xlbl[0]))  # xlbl[0], not .item()
                 else:
                     assert p.shape[1] == len(xlbl)
                     for i in range(p.shape[1]):
-                        ax.semilogx(p[:, i], zKM, label=l + str(xlbl[i]))
+                        draw(ax.semilogx, p[:, i], zKM, label=l + str(xlbl[i]))
 
             except ValueError as e:
                 logging.warning("{} in 1D VER plot. maybe negative value snuck in.".format(e))
 
-    ax.legend(loc="upper right")
-    ax.set_xlabel("Volume emission rate [photons cm$^{-3}$s$^{-1}$]")
-    ax.set_ylabel("$B_\parallel$ [km]")
+    if reuse:  # figure template: limits from the new data, as on a new figure
+        ax.relim()
+        ax.autoscale(True)
+    else:
+        ax.legend(loc="upper right")
+        ax.set_xlabel("Volume emission rate [photons cm$^{-3}$s$^{-1}$]")
+        ax.set_ylabel("$B_\parallel$ [km]")
+
+        ax.yaxis.set_major_locator(MultipleLocator(dymaj))
+        ax.yaxis.set_minor_locator(MultipleLocator(dymin))
+        ax.tick_params(axis="both", which="major", direction="in")
+        ax.grid(True, "both")
 
     #    if not sim.loadver:
     #        titletxt += '\nReactions: {}'.format(sim.reacreq)
 
     ax.set_title(titletxt)
 
-    ax.yaxis.set_major_locator(MultipleLocator(dymaj))
-    ax.yaxis.set_minor_locator(MultipleLocator(dymin))
-    ax.tick_params(axis="both", which="major", direction="in")
-    ax.grid(True, "both")
-
     ax.set_ylim(P["vlim"]["z"])
     ax.set_xlim(P["vlim"]["p1d"])
 
-    writeplots(fg, prefix, T, P["outdir"])
+    writeplots(fg, prefix, T, P["outdir"], doclose=not P.get("templates"))
 
     dumph5(prefix, T, P["outdir"], pfwd1d=pfwd, pinv1d=pinv, z=zKM)
 
@@ -1014,9 +1206,18 @@ def plotVER(sim, ver, x, xp, z, zp, T, P, prefix="", titletxt="", ax=None):
 
                 py.plot(dfg, filename="{}_{}_{}".format(P["outdir"], prefix, T), auto_open=False)
             else:
-                fg, ax = fighandler(ax)
-
-                if pstyle == "pcolor":
+                fg, ax = fighandler(ax, P, prefix + p)
+                tpl = template(P, ax)
+                if tpl is not None and p in tpl:  # figure template: new data, same layout
+                    tpl[p].set_array(ver)
+                    tpl[p].set_clim(vmin, vmax)
+                    ax.set_title(titletxt)
+                    writeplots(fg, prefix + p, T, P["outdir"], doclose=False)
+                    continue
+                # contours can't be updated in place, figure templates use pcolormesh
+                style = "pcolor" if tpl is not None else pstyle
+
+                if style == "pcolor":
                     hc = ax.pcolormesh(
                         xp,
                         zp,
@@ -1029,7 +1230,7 @@ def plotVER(sim, ver, x, xp, z, zp, T, P, prefix="", titletxt="", ax=None):
                     )
                     ax.autoscale(True, tight=True)  # need this to fill axes (does not resize axes)
 
-                elif pstyle == "contour":
+                elif style == "contour":
                     clvl = logspace(log10(vmin), log10(vmax), 6)
 
                     hc = ax.contour(
@@ -1047,7 +1248,7 @@ def plotVER(sim, ver, x, xp, z, zp, T, P, prefix="", titletxt="", ax=None):
                 cbar.set_label("[photons cm$^{-3}$s$^{-1}$]")
                 #            cbar.ax.yaxis.get_offset_text().set_size(afs)
                 cbar.ax.yaxis.get_offset_text().set_position((2, 10))
-                if pstyle == "contour":
+                if style == "contour":
                     cbar.add_lines(hc)
 
                 ax.yaxis.set_major_locator(MultipleLocator(dymaj))
@@ -1065,7 +1266,9 @@ def plotVER(sim, ver, x, xp, z, zp, T, P, prefix="", titletxt="", ax=None):
                 ax.set_ylim(P["vlim"]["z"])
                 ax.set_title(titletxt)
 
-                writeplots(fg, prefix + p, T, P["outdir"])
+                if tpl is not None:
+                    tpl[p] = hc
+                writeplots(fg, prefix + p, T, P["outdir"], doclose=tpl is None)
     else:
         text(0, 0, "Using Actual Data (ver=None)")
 
@@ -1079,20 +1282,26 @@ def plotBcompare(sim, braw, bfit, cam, prefix, tInd, P, ax=None):
 
     dosubtract = False
 
-    fg, ax = fighandler(ax)
+    fg, ax = fighandler(ax, P, prefix)
+    tpl = template(P, ax)
+    draw, reuse = linedrawer(P, ax, prefix)
     #%% plot raw
     cnorm, sfmt = logfmt(P, (-3, 3))
-    ax.get_yaxis().set_major_formatter(sfmt[0])  # only need lin
+    if not reuse:
+        ax.get_yaxis().set_major_formatter(sfmt[0])  # only need lin
 
-    #    ax1.yaxis.get_offset_text().set_size(afs)
-    ax.tick_params(axis="both", which="both", direction="out")
-    ax.set_ylabel("$\mathbf{B}$ [photons sr$^{-1}$ s$^{-1}$]")
+        #    ax1.yaxis.get_offset_text().set_size(afs)
+        ax.tick_params(axis="both", which="both", direction="out")
+        ax.set_ylabel("$\mathbf{B}$ [photons sr$^{-1}$ s$^{-1}$]")
 
     for C in cam:
         if C.usecam:
             # find pixels that were used from this camera
-            ax.plot(
-                C.angle_deg[C.Lcind], braw[C.Lind], label=("$\mathbf{{B}}_{}$".format(C.name)),
+            draw(
+                ax.plot,
+                C.angle_deg[C.Lcind],
+                braw[C.Lind],
+                label=("$\mathbf{{B}}_{}$".format(C.name)),
             )
             # color=cord[icm])#)
     #%% plot fit
@@ -1101,7 +1310,10 @@ def plotBcompare(sim, braw, bfit, cam, prefix, tInd, P, ax=None):
     if bfit is not None:
         maxfit = bfit.max()
         maxraw = braw.max()
-        if 10 * maxraw > maxfit > 0.1 * maxraw:
+        if reuse:  # figure template: the axes of the first frame
+            ax2 = tpl[prefix + "ax2"]
+            singax = ax2 is ax
+        elif 10 * maxraw > maxfit > 0.1 * maxraw:
             ax2 = ax
         else:
             singax = False
@@ -1109,17 +1321,28 @@ def plotBcompare(sim, braw, bfit, cam, prefix, tInd, P, ax=None):
             ax2.get_yaxis().set_major_formatter(sfmt[0])  # only need lin
             ax2.set_ylabel("$\mathbf{\hat{B}}$ [photons sr$^{-1}$ s$^{-1}$]")
 
+        if tpl is not None:
+            tpl[prefix + "ax2"] = ax2
+        draw2, _ = linedrawer(P, ax, prefix + "fit")
         #%% now plot each camera
         for C in cam:
             if C.usecam:
-                ax2.plot(
+                draw2(
+                    ax2.plot,
                     C.angle_deg[C.Lcind],
                     bfit[C.Lind],
                     label="$\hat{{\mathbf{{B}}}}_{}$".format(C.name),
                 )
                 # color=cord[icm]))
 
-    if singax:
+    if reuse:  # figure template: limits from the new data, as on a new figure
+        ax.relim()
+        ax.autoscale(True)
+        ax.set_ylim(P["vlim"]["b"])
+        if not singax:
+            ax2.relim()
+            ax2.autoscale_view()
+    elif singax:
         ax.legend(loc="lower left")
     else:
         """
@@ -1129,14 +1352,15 @@ def plotBcompare(sim, braw, bfit, cam, prefix, tInd, P, ax=None):
         h2, l2 = ax2.get_legend_handles_labels()
         ax.legend(h1 + h2, l1 + l2, loc="upper right")
 
-    ax.set_title("$\mathbf{B}$ ground-observed intensity")
+    if not reuse:
+        ax.set_title("$\mathbf{B}$ ground-observed intensity")
 
-    ax.set_xlabel("local view angle [deg.]")
-    ax.xaxis.set_major_locator(MultipleLocator(1))
+        ax.set_xlabel("local view angle [deg.]")
+        ax.xaxis.set_major_locator(MultipleLocator(1))
 
-    ax.grid(True)
-    ax.autoscale(True, axis="x", tight=True)
-    ax.set_ylim(P["vlim"]["b"])  # after autoscale
+        ax.grid(True)
+        ax.autoscale(True, axis="x", tight=True)
+        ax.set_ylim(P["vlim"]["b"])  # after autoscale
     #%% do more detailed comparison
     if dosubtract and bfit is not None:
         bias = []
@@ -1171,7 +1395,7 @@ def plotBcompare(sim, braw, bfit, cam, prefix, tInd, P, ax=None):
         ut1_unix=ut1_unix,
     )
 
-    writeplots(fg, prefix, T, P["outdir"], fmt=".eps")
+    writeplots(fg, prefix, T, P["outdir"], fmt=".eps", doclose=not P.get("templates"))
 
 
 #%%
@@ -1180,7 +1404,8 @@ def plotB(bpix, cam, T, P, labeltxt="", ax=None):
 
     cnorm, sfmt = logfmt(P)
 
-    fg, ax = fighandler(ax)
+    fg, ax = fighandler(ax, P, "b" + labeltxt[4:7])
+    draw, reuse = linedrawer(P, ax, "b")
 
     std = []
     #%% do we need twinax? Let's find out if they're within factor of 10
@@ -1205,12 +1430,22 @@ def plotB(bpix, cam, T, P, labeltxt="", ax=None):
             if C.noiselam is not None:
                 std.append("{:0.1e}".format(C.noiselam))
 
-            ax.plot(C.angle_deg[C.Lcind], bpix[C.Lind], label=labeltxt + "," + str(C.name) + "}$")
+            draw(
+                ax.plot,
+                C.angle_deg[C.Lcind],
+                bpix[C.Lind],
+                label=labeltxt + "," + str(C.name) + "}$",
+            )
             # marker='.',
             # color=cord[c])
-    doBlbl(ax, sfmt[0], P["vlim"]["b"], labeltxt, std)  # b is never log
+    if reuse:  # figure template: limits from the new data, as on a new figure
+        ax.relim()
+        ax.autoscale(True, tight=True)
+        ax.set_ylim(P["vlim"]["b"])
+    else:
+        doBlbl(ax, sfmt[0], P["vlim"]["b"], labeltxt, std)  # b is never log
 
-    writeplots(fg, "b" + labeltxt[4:7], T, P["outdir"])
+    writeplots(fg, "b" + labeltxt[4:7], T, P["outdir"], doclose=not P.get("templates"))
 
 
 def doBlbl(axb, sfmt, vlim, labeltxt, noiselam):
@@ -1293,189 +1528,120 @@ def planview3(cam, xKM, zKM, P):
 
 #%% gaussian fit
 def getx0E0(Phifwd, Phifit, E, x, tInd, P, E0min):
+    """
+    peakest.gaussx0E0(), and its figure if "gfit" in makeplot.
+    Numerical code uses peakest directly.
+    """
     assert isinstance(P, dict), "function arguments: out of order?"
 
-    Npts = 200
-    Nptsfits = (Npts // 40, Npts // 20)  # (nEnergyToUse+-, nXtouse+-)
-
-    def clipPhi(fwd, fit, E):
-        Elin = linspace(E[0], E[-1], Npts)
-
-        try:
-            phifwd = fwd.copy()
-            phifwd[E < E0min, :] = 0.0
-            f = interp1d(E, phifwd, kind="linear", axis=0)
-            fwdlin = f(Elin)
-        except AttributeError:
-            fwdlin = None
-
-        try:
-            phifit = fit.copy()
-            phifit[E < E0min, :] = 0.0
-            f = interp1d(E, phifit, kind="linear", axis=0)
-            fitlin = f(Elin)
-        except AttributeError:
-            fitlin = None
-
-        return fwdlin, fitlin, Elin
-
-    cPhifwd, cPhifit, Elin = clipPhi(Phifwd, Phifit, E)
-    #%% first guess of 2-D peak, take region of pixels near the peak to fit
-    # note that unravel_index for jf must be order='C'
-    def gfitphi(Philin, Elin):
-        if Philin is None:
-            return nan, nan, None, None
-
-        pkrow, pkcol = unravel_index(Philin.argmax(axis=None), Philin.shape, order="C")
-        nh = Nptsfits  # MxN region to extract
-        rcpluck = pkrow - nh[0], pkcol - nh[1]
-        gpeak = Philin[rcpluck[0] : pkrow + nh[0], rcpluck[1] : pkcol + nh[1]]
-        # set_trace()
-        try:
-            gparam = gaussfit(gpeak, returnfitimage=False)
-        except ValueError:
-            logging.error(
-                "gaussian fit peak against edge of model space."
-                "gpix shape {} row {} col {}".format(gpeak.shape, pkrow, pkcol)
-            )
-            return nan, nan, None, None
-
-        Ghcol = int(round(gparam[2] + rcpluck[1]))
-        Ghrow = int(round(gparam[3] + rcpluck[0])) + 1  # altitude of peak
-
-        gparamshift = gparam.copy()
-        gparamshift[2] = gparam[2] + rcpluck[1]
-        gparamshift[3] = gparam[3] + rcpluck[0]
-        gpix = twodgaussian(gparamshift, shape=Philin.shape)
-
-        try:
-            return x[Ghcol], Elin[Ghrow], gpix, gpeak
-        except IndexError:
-            logging.error("gaussian fit was outside model space")
-            return nan, nan, None, None
-
-    gx0 = empty(2)
-    gE0 = empty(2)
-    gpix = []
-    gpeak = []
-    for i, p in enumerate((cPhifwd, cPhifit)):
-        gx0[i], gE0[i], gp, gk = gfitphi(p, Elin)
-        gpix.append(gp)
-        gpeak.append(gk)
+    gx0, gE0, gfit = gaussx0E0(Phifwd, Phifit, E, x, E0min)
 
     if "gfit" in P["makeplot"]:
-        fg, ax = subplots(2, 3, sharey=False, sharex=False)
-
-        ca = ax[0, 0]
-        try:
-            hb = ca.pcolormesh(x, Elin, cPhifwd)
-            fg.colorbar(hb, ax=ca)
-            ca.set_title("$\Phi$ fwd precip. intensity")
-            # ca.set_xlabel('$B_\perp$ [km]')
-            ca.set_ylabel("Beam Energy [eV]")
-            ca.set_yscale("log")
-            ca.autoscale(True, tight=True)
-        except AttributeError:
-            ca.text(0, 0, "$\Phi$ Not Used")
-
-        ca = ax[0, 1]
-        try:
-            hp = ca.pcolormesh(gpeak[0])
-            fg.colorbar(hp, ax=ca)
-            ca.set_title(
-                "$\Phi$ peak region to fit:"
-                " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[0], gE0[0])
-            )
-            # ca.set_yscale('log')
-            ca.autoscale(True, tight=True)  # ValueError: cannot convert float NaN to integer
-        except AttributeError:
-            ca.text(0, 0, "$\Phi$ not used")
-
-        ca = ax[0, 2]
-        try:
-            hp = ca.pcolormesh(x, Elin, gpix[0])
-            fg.colorbar(hp, ax=ca)
-            ca.set_title(
-                "$\Phi$ gaussian fit:" " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[0], gE0[0])
-            )
-            ca.set_yscale("log")
-            ca.autoscale(True, tight=True)
-        except AttributeError:
-            ca.text(0, 0, "$\Phi$ not used")
+        plotgfit(gfit, x, gx0, gE0, tInd, P)
 
-        ca = ax[1, 0]
-        try:
-            hb = ca.pcolormesh(x, Elin, cPhifit)
-            fg.colorbar(hb, ax=ca)
-            ca.set_title("$\hat{\Phi}$ est. precip. intensity")
-            ca.set_xlabel("$B_\perp$ [km]")
-            ca.set_ylabel("Beam Energy [eV]")
-            ca.set_yscale("log")
-            ca.autoscale(True, tight=True)
-        except AttributeError:
-            ca.text(0, 0, "$\hat{\Phi} not used")
-
-        ca = ax[1, 1]
-        try:
-            hp = ca.pcolormesh(gpeak[1])
-            fg.colorbar(hp, ax=ca)
-            ca.set_title(
-                "$\hat{{\Phi}}$ peak region to fit:"
-                " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[1], gE0[1])
-            )
-            # ca.set_yscale('log')
-            ca.autoscale(True, tight=True)
-        except AttributeError:
-            ca.text(0, 0, "$\hat{\Phi}$ not used")
+    return gx0, gE0  # , x[pkcol], Elin[pkrow]
 
-        ca = ax[1, 2]
-        try:
-            hp = ca.pcolormesh(x, Elin, gpix[1])
-            fg.colorbar(hp, ax=ca)
-            ca.set_title(
-                "$\hat{{\Phi}}$ est. via gaussian fit:"
-                " $\hat{{B}}_{{\perp,0}}, \hat{{E}}_0$={:.2f},{:.0f})".format(gx0[1], gE0[1])
-            )
-            ca.set_xlabel("$B_\perp$ [km]")
-            ca.set_yscale("log")
-            ca.autoscale(True, tight=True)
-        except AttributeError:
-            ca.text(0, 0, "$\hat{\Phi} not used")
 
-        writeplots(fg, "gaussfitlin", tInd, P["outdir"])
+def plotpeak(Phi0, Phifit, x, sim, tInd, P):
+    """
+    figure of the gaussian fits near the flux peak. The estimated (x0, E0) shown are those
+    computed in FitVER, the forward (x0, E0) is found here by the same sim.peakestimator.
+    """
+    E = Phifit["EK"]
+    gx0, gE0, gfit = gaussx0E0(Phi0, Phifit["x"], E, x, sim.minenergy)
+    if sim.peakestimator != "gaussian":
+        gx0, gE0, _ = peakx0E0(Phi0, None, E, x, sim.minenergy, sim.peakestimator)
+    gx0[1], gE0[1] = Phifit["gx0"], Phifit["gE0"]
 
-    # Ghrow,Ghcol = np.unravel_index(gfit.argmax(axis=None),gfit.shape, order='C')
+    plotgfit(gfit, x, gx0, gE0, tInd, P)
 
-    return gx0, gE0  # , x[pkcol], Elin[pkrow]
 
+def plotgfit(gfit, x, gx0, gE0, tInd, P):
+    """
+    peak regions and 2-D gaussian fits of peakest.gaussx0E0()
+    """
+    Elin, cPhifwd, cPhifit = gfit["Elin"], gfit["phifwd"], gfit["phifit"]
+    gpix, gpeak = gfit["gpix"], gfit["gpeak"]
 
-#%% write hdf5
-def dumph5(prefix, tInd, odir=None, **writevar):  # used in other .py too
-    if prefix is None or odir is None:
-        return
+    fg, ax = subplots(2, 3, sharey=False, sharex=False)
 
-    fn = Path(odir).expanduser() / (f"dump {nametime(tInd)}.h5")
+    ca = ax[0, 0]
+    try:
+        hb = ca.pcolormesh(x, Elin, cPhifwd)
+        fg.colorbar(hb, ax=ca)
+        ca.set_title("$\Phi$ fwd precip. intensity")
+        # ca.set_xlabel('$B_\perp$ [km]')
+        ca.set_ylabel("Beam Energy [eV]")
+        ca.set_yscale("log")
+        ca.autoscale(True, tight=True)
+    except AttributeError:
+        ca.text(0, 0, "$\Phi$ Not Used")
+
+    ca = ax[0, 1]
+    try:
+        hp = ca.pcolormesh(gpeak[0])
+        fg.colorbar(hp, ax=ca)
+        ca.set_title(
+            "$\Phi$ peak region to fit:"
+            " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[0], gE0[0])
+        )
+        # ca.set_yscale('log')
+        ca.autoscale(True, tight=True)  # ValueError: cannot convert float NaN to integer
+    except AttributeError:
+        ca.text(0, 0, "$\Phi$ not used")
 
-    if not fn.is_file():
-        print(f"creating {fn}")
+    ca = ax[0, 2]
+    try:
+        hp = ca.pcolormesh(x, Elin, gpix[0])
+        fg.colorbar(hp, ax=ca)
+        ca.set_title(
+            "$\Phi$ gaussian fit:" " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[0], gE0[0])
+        )
+        ca.set_yscale("log")
+        ca.autoscale(True, tight=True)
+    except AttributeError:
+        ca.text(0, 0, "$\Phi$ not used")
 
-    logging.info(f"dumping {prefix} to {fn}")
-    with h5py.File(str(fn), "a", libver="latest") as H:
-        for k, v in writevar.items():
-            if v is None:
-                continue
+    ca = ax[1, 0]
+    try:
+        hb = ca.pcolormesh(x, Elin, cPhifit)
+        fg.colorbar(hb, ax=ca)
+        ca.set_title("$\hat{\Phi}$ est. precip. intensity")
+        ca.set_xlabel("$B_\perp$ [km]")
+        ca.set_ylabel("Beam Energy [eV]")
+        ca.set_yscale("log")
+        ca.autoscale(True, tight=True)
+    except AttributeError:
+        ca.text(0, 0, "$\hat{\Phi} not used")
+
+    ca = ax[1, 1]
+    try:
+        hp = ca.pcolormesh(gpeak[1])
+        fg.colorbar(hp, ax=ca)
+        ca.set_title(
+            "$\hat{{\Phi}}$ peak region to fit:"
+            " $B_{{\perp,0}},E_0$={:.2f},{:.0f})".format(gx0[1], gE0[1])
+        )
+        # ca.set_yscale('log')
+        ca.autoscale(True, tight=True)
+    except AttributeError:
+        ca.text(0, 0, "$\hat{\Phi}$ not used")
 
-            K = "/{}/{}".format(prefix, k)
-            if K in H:  # allow for overwriting with different sized array
-                del H[K]
+    ca = ax[1, 2]
+    try:
+        hp = ca.pcolormesh(x, Elin, gpix[1])
+        fg.colorbar(hp, ax=ca)
+        ca.set_title(
+            "$\hat{{\Phi}}$ est. via gaussian fit:"
+            " $\hat{{B}}_{{\perp,0}}, \hat{{E}}_0$={:.2f},{:.0f})".format(gx0[1], gE0[1])
+        )
+        ca.set_xlabel("$B_\perp$ [km]")
+        ca.set_yscale("log")
+        ca.autoscale(True, tight=True)
+    except AttributeError:
+        ca.text(0, 0, "$\hat{\Phi} not used")
 
-            try:
-                if isinstance(v, ndarray) and v.ndim > 1:
-                    H.create_dataset(K, data=v, compression="gzip")
-                else:
-                    H[K] = v
-            except Exception as e:
-                logging.error(f"failed to write {fn} {K}.  {e}")
+    writeplots(fg, "gaussfitlin", tInd, P["outdir"])
 
 
 def indone1d(x, P, i):
@@ -1507,14 +1673,21 @@ def indone1d(x, P, i):
     return Jxi
 
 
-def fighandler(ax):
+def fighandler(ax, P=None, name=None):
     """
     subplot: ax=Axes  <-- do nothing
     newfig:  ax=None   <--create new figure
+    figure templates: the figure `name` of the previous frame is reused
     """
     if ax is None:  # new figure, create axes
+        keep = P is not None and P.get("templates")
+        if keep and name in _templates:
+            return _templates[name]
+
         fg = figure()
         ax = fg.gca()
+        if keep:
+            _templates[name] = fg, ax
     else:
         fg = None  # disables savefig, for existing subplots
 
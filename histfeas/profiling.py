@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+"""
+per-phase wall time, CPU time and peak memory of a doSim run, optionally with cProfile.
+The summary is written as JSON to the output directory, to track performance regressions.
+"""
+from pathlib import Path
+import logging
+import json
+from contextlib import contextmanager
+from time import perf_counter, process_time
+from sys import platform
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def peakrss():
+    """
+    peak resident memory of this process [MB], None where not available
+    """
+    if resource is None:
+        return None
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return rss / 2 ** 20 if platform == "darwin" else rss / 2 ** 10
+
+
+class PhaseTimer:
+    """
+    with timer.phase('getEll'):
+        ...
+    records wall and CPU seconds of each phase, and the process peak RSS at its end.
+    frame: time index of per-frame phases
+    cprofile: also capture a cProfile of everything between start() and write()
+    """
+
+    def __init__(self, cprofile=False):
+        self.phases = []
+        self.prof = None
+        if cprofile:
+            import cProfile
+
+            self.prof = cProfile.Profile()
+
+    def start(self):
+        if self.prof is not None:
+            self.prof.enable()
+
+    @contextmanager
+    def phase(self, name, frame=None):
+        w0, c0 = perf_counter(), process_time()
+        try:
+            yield
+        finally:
+            self.phases.append(
+                {
+                    "phase": name,
+                    "frame": None if frame is None else int(frame),
+                    "wall": perf_counter() - w0,
+                    "cpu": process_time() - c0,
+                    "peakrss_mb": peakrss(),
+                }
+            )
+
+    def totals(self):
+        """
+        wall and CPU seconds per phase name, summed over frames
+        """
+        tot = {}
+        for p in self.phases:
+            t = tot.setdefault(p["phase"], {"n": 0, "wall": 0.0, "cpu": 0.0})
+            t["n"] += 1
+            t["wall"] += p["wall"]
+            t["cpu"] += p["cpu"]
+
+        return tot
+
+    def write(self, odir, meta=None):
+        """
+        profile.json (and doSim.pstats with cProfile) in odir
+        """
+        if self.prof is not None:
+            self.prof.disable()
+
+        tot = self.totals()
+        for k, t in tot.items():
+            logging.info("{:>12s} {:4d}x  wall {:8.2f} s  cpu {:8.2f} s".format(k, t["n"], t["wall"], t["cpu"]))
+
+        if odir is None:
+            return
+
+        odir = Path(odir).expanduser()
+        summary = {
+            "meta": meta or {},
+            "peakrss_mb": peakrss(),
+            "totals": tot,
+            "phases": self.phases,
+        }
+        fn = odir / "profile.json"
+        print("writing", fn)
+        fn.write_text(json.dumps(summary, indent=1, default=str))
+
+        if self.prof is not None:
+            fn = odir / "doSim.pstats"
+            print("writing", fn)
+            self.prof.dump_stats(str(fn))
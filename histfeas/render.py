@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+"""
+figures of a run rendered from its results store, separately from the computation:
+one figure per task in a process pool, so the compute loop is not paced by matplotlib.
+
+During a run: RunHistfeas.py ... -m fwd optim --defer-plots
+After a run:  python -m histfeas.render out/myrun -m fwd optim
+"""
+from pathlib import Path
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import get_context
+from time import time
+import h5py
+
+from . import getParams, plotsetup, gitrev
+from .observeVolume import definecamind, loadhit
+from .results import STORENAME, setdumping
+
+FIGURES = ("fwd", "optim")  # -m choices rendered here
+
+_run = {}  # per worker process: parameters, cameras and open store
+
+
+def render(P, workers=None):
+    """
+    render the per-frame figures of P["makeplot"] from P["outdir"]/results.h5
+    """
+    fn = Path(P["outdir"]).expanduser() / STORENAME
+    with h5py.File(str(fn), "r", libver="latest") as f:
+        nframe = f["/time"].shape[0]
+
+    tasks = [(i, k) for i in range(nframe) for k in FIGURES if k in P["makeplot"]]
+    if not tasks:
+        return
+
+    P = dict(P, load=True)  # don't copy the .ini again
+    print(f"rendering {len(tasks)} figures from {fn}")
+    tic = time()
+    # spawn: workers start without the parent's matplotlib and HDF5 state
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=get_context("spawn"), initializer=initrender, initargs=(P,)
+    ) as pool:
+        futures = {pool.submit(renderframe, i, k): (i, k) for i, k in tasks}
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception as e:
+                logging.error(f"rendering {futures[fut]} failed.  {e}")
+
+    print(f"rendered {len(tasks)} figures in {time() - tic:.1f} sec.")
+
+
+def initrender(P):
+    """
+    per worker: setup as loadAnalyze.readresults(), once
+    """
+    plotsetup()
+    setdumping(False)  # the arrays are already in the store
+
+    arc, sim, cam, Fwd, P = getParams(P)
+    cam = definecamind(cam, None, loadhit(sim))
+
+    f = h5py.File(str(Path(P["outdir"]).expanduser() / STORENAME), "r", libver="latest")
+    angle = f["/best/angle"][()] if "/best/angle" in f else None
+    ut1_unix = f["/best/ut1_unix"][()] if "/best/ut1_unix" in f else None
+    for i, C in enumerate(cam):
+        if C.usecam:
+            if angle is not None:
+                C.angle_deg = angle[i, :]
+            if sim.realdata and ut1_unix is not None:
+                C.tKeo = ut1_unix[:, i]
+
+    _run.update(P=P, sim=sim, cam=cam, f=f, times=f["/time"].asstr()[()])
+
+
+def renderframe(i, kind):
+    from .plotsnew import plotfwd, plotoptim, closeplots
+
+    P, sim, cam, f = _run["P"], _run["sim"], _run["cam"], _run["f"]
+    # real data: row of C.tKeo; simulation: time index of the run
+    tInd = i if sim.realdata else int(_run["times"][i])
+
+    def get(k):
+        return f[k][i] if k in f else None
+
+    x, xp, z, zp = (f[k][()] for k in ("/pest/x", "/pest/xp", "/pest/z", "/pest/zp"))
+    phi = "/phiest" if "/phiest/Ek" in f else "/phifwd"
+    Phifit = {
+        "x": get("/phiest/phi"),
+        "EK": f[phi + "/Ek"][()],
+        "EKpcolor": f[phi + "/EKpcolor"][()],
+        "gx0": get("/phiest/gx0"),
+        "gE0": get("/phiest/gE0"),
+    }
+    drn, pfwd, phifwd = get("/best/braw"), get("/pfwd/p"), get("/phifwd/phi")
+
+    if kind == "fwd":
+        plotfwd(sim, cam, drn, x, xp, z, zp, pfwd, phifwd, Phifit, tInd, P, doSubplots=True)
+    elif kind == "optim":
+        plotoptim(
+            sim,
+            cam,
+            drn,
+            get("/best/bfit"),
+            "best",
+            pfwd,
+            phifwd,
+            get("/pest/p"),
+            Phifit,
+            x,
+            xp,
+            z,
+            zp,
+            tInd,
+            P,
+            doSubplots=True,
+        )
+
+    closeplots()  # with figure templates, the worker reuses its figures for the next frame
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    p = ArgumentParser(description="render figures of a HiSTfeas run from its results store")
+    p.add_argument("outdir", help="output directory of the run")
+    p.add_argument("-m", "--makeplot", help="plots to make", default=list(FIGURES), nargs="+")
+    p.add_argument("-j", "--workers", help="number of processes", type=int)
+    p.add_argument(
+        "--templates",
+        help="build each figure once per process, then update it",
+        action="store_true",
+    )
+    p = p.parse_args()
+
+    outdir = Path(p.outdir).expanduser()
+    ini = sorted(outdir.glob("*.ini"))
+    if not ini:
+        raise FileNotFoundError(f"no simulation ini found in {outdir}")
+    # the camera positions, fit method and iterations of the run
+    with h5py.File(str(outdir / STORENAME), "r", libver="latest") as f:
+        A = dict(f.attrs)
+
+    P = {
+        "ini": ini[0],
+        "outdir": outdir,
+        "load": True,
+        "makeplot": p.makeplot,
+        "templates": p.templates,
+        "verbose": 0,
+        "cmd": A.get("cmd", ""),
+        "gitrev": A.get("gitrev", gitrev()),
+        "overrides": {
+            "rootdir": Path(__file__).parents[1],
+            "camx": A.get("camx") if "--cx" in A.get("cmd", "") else None,
+            "fitm": A.get("fitm"),
+            "niter": int(A["niter"]) if "niter" in A else None,
+        },
+    }
+
+    render(P, p.workers)
@@ -0,0 +1,295 @@
+#!/usr/bin/env python
+"""
+HDF5 output of results, without plotting imports, so compute-only runs (-m h5) don't load
+the histfeas plotting modules. (matplotlib and xarray still come with histutils' camera class.)
+
+While doSim runs, results go to one store outdir/results.h5 kept open for the whole run:
+each /prefix/variable has the frame as its first, extendable axis, and variables
+that are the same for every frame (grid, energy bins, camera angles) are written once.
+"""
+from pathlib import Path
+import logging
+import atexit
+from datetime import datetime
+import h5py
+from numpy import asarray, nan, ndarray
+
+from .nans import nans
+from .writer import flushwriter, submit
+
+
+def nametime(tind):
+    """
+    file name suffix of a time index or time, as gridaurora.plots.nametime()
+    """
+    if isinstance(tind, int) and tind < 1e6:
+        return "{:03d}".format(tind)
+    elif isinstance(tind, datetime):
+        return tind.isoformat()[:-3]  # -3 truncates to millisecond digits only (arbitrary)
+    elif tind is not None:
+        return str(tind)
+    else:  # is None
+        return ""
+
+
+def tind2dt(cam, tind):
+    # NOTE: the [:-3] is arbitrary to keep 3 digits right of the decimal.
+
+    try:  # first run
+        return datetime.utcfromtimestamp(cam[0].tKeo[tind]).isoformat()[:-3]
+    except IndexError:  # loading data
+        return datetime.utcfromtimestamp(cam[0].tKeo).isoformat()[:-3]
+    except (
+        AttributeError,
+        OSError,
+        ValueError,
+    ):  # simdata  #OSError (ValueError on Linux) thrown when nan fed into utcfromtimestamp
+        return str(tind)
+
+
+#%% run store
+STORENAME = "results.h5"
+# written once per run, not per frame
+INVARIANT = {"x", "xp", "z", "zp", "Ek", "EKpcolor", "angle"}
+
+_store = None
+_dumping = True
+
+
+class RunStore:
+    """
+    one HDF5 file of all frames of a run. /time holds the frame labels (tind2dt);
+    row i of every time-indexed dataset is frame /time[i].
+    """
+
+    def __init__(self, odir, meta=None):
+        self.odir = Path(odir).expanduser()
+        self.fn = self.odir / STORENAME
+        print(f"writing results to {self.fn}")
+        self.f = h5py.File(str(self.fn), "a", libver="latest")
+
+        if "/time" not in self.f:
+            self.f.create_dataset(
+                "/time", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(), chunks=(256,)
+            )
+        # re-running into the same outdir continues the existing rows
+        times = self.f["/time"].asstr()[()]
+        self.rows = {t: i for i, t in enumerate(times)}
+
+        self.setattrs(meta or {})
+
+    def setattrs(self, meta):
+        for k, v in meta.items():
+            if v is None:
+                continue
+            try:
+                self.f.attrs[k] = v
+            except TypeError as e:
+                logging.error(f"run attribute {k}={v} not written.  {e}")
+
+    def row(self, T):
+        T = str(T)
+        if T not in self.rows:
+            i = len(self.rows)
+            self.f["/time"].resize(i + 1, axis=0)
+            self.f["/time"][i] = T
+            self.rows[T] = i
+            self.f.flush()  # previous frame complete on disk
+
+        return self.rows[T]
+
+    def write(self, prefix, T, **writevar):
+        i = self.row(T)
+        for k, v in writevar.items():
+            if v is None:
+                continue
+
+            K = "/{}/{}".format(prefix, k)
+            try:
+                if k in INVARIANT:
+                    if K not in self.f:
+                        self.f[K] = v
+                    continue
+
+                v = asarray(v)
+                if K not in self.f:
+                    self.create(K, v)
+
+                D = self.f[K]
+                if D.shape[0] <= i:
+                    D.resize(i + 1, axis=0)
+                D[i, ...] = v
+            except Exception as e:
+                logging.error(f"failed to write {self.fn} {K}.  {e}")
+
+    def create(self, K, v):
+        # one frame per chunk for images, many frames per chunk for small vectors
+        nt = 1 if v.size >= 1024 else 256
+        self.f.create_dataset(
+            K,
+            shape=(0,) + v.shape,
+            maxshape=(None,) + v.shape,
+            dtype=v.dtype,
+            chunks=(nt,) + v.shape if v.size else True,
+            compression="gzip" if v.ndim > 1 else None,
+            fillvalue=nan if v.dtype.kind == "f" else 0,
+        )
+
+    def close(self, **meta):
+        if not self.f:
+            return
+
+        meta["nframes"] = len(self.rows)
+        self.setattrs(meta)
+        self.f.close()
+
+
+def openstore(odir, meta=None):
+    """
+    dumph5() to odir goes to this store until closestore()
+    """
+    global _store
+
+    closestore()
+    if odir is None:
+        return
+
+    _store = RunStore(odir, meta)
+    atexit.register(closestore)
+
+    return _store
+
+
+def closestore(**meta):
+    global _store
+
+    flushwriter()  # pending writes go to this store
+    if _store is not None:
+        _store.close(**meta)
+        _store = None
+
+
+def writeanalysis(fn, analyses):
+    """
+    whole-run analysis results of each arc (analysehst.analyseres()) into /analysis/<arc> of
+    the results store fn, replacing those of an earlier analysis.
+    The store is opened for writing only here, so it must not be open elsewhere in the process.
+    """
+    try:
+        f = h5py.File(str(fn), "r+", libver="latest")
+    except OSError as e:
+        logging.error(f"{fn} is read-only, analysis results not written.  {e}")
+        return
+
+    with f:
+        for arc, A in analyses.items():
+            for k, v in A.items():
+                if v is None:
+                    continue
+
+                K = f"/analysis/{arc}/{k}"
+                if K in f:
+                    del f[K]
+                f[K] = v
+
+
+def setdumping(on):
+    """
+    False: dumph5() writes nothing, e.g. when re-rendering figures from the store
+    """
+    global _dumping
+
+    _dumping = on
+
+
+#%% write hdf5
+def dumph5(prefix, tInd, odir=None, **writevar):  # used in other .py too
+    if prefix is None or odir is None or not _dumping:
+        return
+
+    submit(writeh5, prefix, tInd, odir, **writevar)  # in the background writer, if running
+
+
+def writeh5(prefix, tInd, odir, **writevar):
+    if _store is not None and _store.odir == Path(odir).expanduser():
+        _store.write(prefix, nametime(tInd), **writevar)
+        return
+
+    fn = Path(odir).expanduser() / (f"dump {nametime(tInd)}.h5")
+
+    if not fn.is_file():
+        print(f"creating {fn}")
+
+    logging.info(f"dumping {prefix} to {fn}")
+    with h5py.File(str(fn), "a", libver="latest") as H:
+        for k, v in writevar.items():
+            if v is None:
+                continue
+
+            K = "/{}/{}".format(prefix, k)
+            if K in H:  # allow for overwriting with different sized array
+                del H[K]
+
+            try:
+                if isinstance(v, ndarray) and v.ndim > 1:
+                    H.create_dataset(K, data=v, compression="gzip")
+                else:
+                    H[K] = v
+            except Exception as e:
+                logging.error(f"failed to write {fn} {K}.  {e}")
+
+
+def dumpframe(sim, cam, Fwd, drn, dhat, ver, Phi0, vfit, Phifit, tInd, P):
+    """
+    compute-only counterpart of plotsnew.goPlot(): the HDF5 datasets that plotfwd() and
+    plotoptim() write, without making the figures. loadAnalyze.readresults() reads either.
+    """
+    T = tind2dt(cam, tInd)
+    odir = P["outdir"]
+    x, xp, z, zp = Fwd["x"], Fwd["xPixCorn"], Fwd["z"], Fwd["zPixCorn"]
+    #%% forward model
+    if "fwd" in P["makeplot"] and not sim.realdata:
+        dumph5("pfwd", T, odir, p=ver, x=x, xp=xp, z=z, zp=zp)
+        dumph5("phifwd", T, odir, phi=Phi0, xp=xp, Ek=Phifit["EK"], EKpcolor=Phifit["EKpcolor"])
+    #%% estimation
+    if "optim" not in P["makeplot"]:
+        return
+
+    if isinstance(dhat, dict):
+        dhat = dhat["optim"]
+
+    if isinstance(vfit, dict):
+        vfit = vfit["optim"]
+
+    if sim.realdata:
+        try:
+            ut1_unix = [c.tKeo[tInd] for c in cam if c.usecam]
+        except IndexError:
+            ut1_unix = [c.tKeo for c in cam if c.usecam]
+    else:
+        ut1_unix = nans(len(cam))
+
+    dumph5(
+        "best",
+        T,
+        odir,
+        angle=[C.angle_deg for C in cam if C.usecam],
+        braw=drn,
+        bfit=dhat,
+        ut1_unix=ut1_unix,
+    )
+
+    dumph5("pest", T, odir, p=vfit, x=x, xp=xp, z=z, zp=zp)
+
+    if Phifit is not None and Phifit["x"] is not None:
+        dumph5(
+            "phiest",
+            T,
+            odir,
+            phi=Phifit["x"],
+            xp=xp,
+            Ek=Phifit["EK"],
+            EKpcolor=Phifit["EKpcolor"],
+            gx0=Phifit["gx0"],
+            gE0=Phifit["gE0"],
+        )
@@ -2,7 +2,7 @@
 from pathlib import Path
 import logging
 from hashlib import md5
-from numpy import asarray, arange, isfinite, ceil, hypot, atleast_1d, fromstring
+from numpy import asarray, arange, isfinite, ceil, hypot, atleast_1d, fromstring, diff, append, inf
 import numpy as np  # needed for all
 from datetime import datetime
 from dateutil.parser import parse
@@ -10,6 +10,8 @@ from dateutil.parser import parse
 #
 from transcarread import getaltgrid
 
+from .peakest import ESTIMATORS
+
 DPI = 72
 
 
@@ -96,6 +98,32 @@ class Sim:
         self.optimmaxiter = P["overrides"]["niter"]
         if self.optimmaxiter is None:
             self.optimmaxiter = sp.getint("recon", "OptimMaxiter", fallback=None)
+        # float32 halves memory of L and the precomposed operator, and speeds sparse mat-vec
+        self.dtype = P["overrides"].get("dtype")
+        if self.dtype is None:
+            self.dtype = sp.get("recon", "dtype", fallback="float64")
+        self.dtype = np.dtype(self.dtype)
+        if self.dtype not in (np.float32, np.float64):
+            raise ValueError("dtype must be float32 or float64, not {}".format(self.dtype))
+        # leave flux unknowns that no camera pixel observes out of the minimization
+        self.prunefit = sp.getboolean("recon", "pruneUnobserved", fallback=True)
+        # simulation: additional fits of this many noise realizations per frame, reproducible by seed
+        self.noiserealizations = sp.getint("recon", "noiseRealizations", fallback=0)
+        self.noiseseed = sp.getint("recon", "noiseSeed", fallback=None)
+        # leave pixels whose ray misses the grid out of the minimization
+        self.dropemptyrows = sp.getboolean("recon", "dropEmptyRows", fallback=False)
+        # coarse-to-fine inversion levels, 1: single full resolution inversion
+        self.multireslevels = P["overrides"].get("multires")
+        if self.multireslevels is None:
+            self.multireslevels = sp.getint("recon", "multiresLevels", fallback=1)
+        # (B_perp, E_0) of the flux peak: fast log-parabola or gaussian fit (needs gaussfitter)
+        self.peakestimator = sp.get("recon", "peakEstimator", fallback="fast").lower()
+        if self.peakestimator not in ESTIMATORS:
+            raise ValueError(
+                f"peakEstimator must be one of {ESTIMATORS}, not {self.peakestimator}"
+            )
+        # pending HDF5/PNG writes queued to the background writer thread, 0: write synchronously
+        self.writequeue = sp.getint("sim", "writeQueue", fallback=32)
         #%% force compute ell
         try:
             if P["overrides"]["ell"]:
@@ -142,10 +170,13 @@ class Sim:
         self.realdata = sp.getboolean("sim", "realdata", fallback=None)
         if self.realdata:
             self.realdatapath = Path(sp["cams"]["ActualDataDir"]).expanduser()
+        # stream raw video from disk, keeping this many raw frames per camera in memory
+        self.rawframewindow = sp.getint("cams", "rawFrameWindow", fallback=None)
 
         self.raymap = sp["cams"]["RayAngleMapping"].lower()
 
         self.downsampleEnergy = sp.getfloat("transcar", "downsampleEnergy", fallback=False)
+        self.nEnergyBins = sp.getint("transcar", "nEnergyBins", fallback=None)
 
         if self.raymap == "astrometry":
             logging.info("Using ASTROMETRY-based per-pixel 1D cut mapping to 2D model space")
@@ -192,6 +223,16 @@ class Sim:
         self.fwd_xlim = (sp.getfloat("fwd", "XminKM"), sp.getfloat("fwd", "XmaxKM"))
         self.fwd_zlim = (sp.getfloat("fwd", "ZminKM"), sp.getfloat("fwd", "ZmaxKM"))
         self.fwd_dxKM = sp.getfloat("fwd", "XcellKM")
+        #%% optional nonuniform x-grid: fine cells over XfineKM, stretching out to XminKM,XmaxKM
+        self.fwd_xedges = None
+        if sp.get("fwd", "XfineKM", fallback=None):
+            self.fwd_xedges = makexedges(
+                self.fwd_xlim,
+                self.fwd_dxKM,
+                fromstring(sp["fwd"]["XfineKM"], dtype=float, sep=","),
+                sp.getfloat("fwd", "XstretchFactor", fallback=1.5),
+                sp.getfloat("fwd", "XcellMaxKM", fallback=inf),
+            )
 
         if self.useztranscar:
             Fwd["x"] = makexzgrid(self.fwd_xlim, None, self.fwd_dxKM, None)[0]
@@ -206,6 +247,20 @@ class Sim:
             raise ValueError(
                 "You must specify zmax zmin zcell when not using transcar altitudes in XLS"
             )
+        #%% x cell corners, used by EllLineLength and plots
+        if self.fwd_xedges is not None:
+            Fwd["xPixCorn"] = self.fwd_xedges
+            Fwd["x"] = self.fwd_xedges[:-1] + 0.5 * diff(self.fwd_xedges)
+            logging.info(
+                "nonuniform x-grid: {} cells, width {:.3f} to {:.3f} km".format(
+                    Fwd["x"].size, diff(self.fwd_xedges).min(), diff(self.fwd_xedges).max()
+                )
+            )
+        else:
+            # shift left half a cell to get the corner, last column by shifting half-cell to the right
+            Fwd["xPixCorn"] = append(
+                Fwd["x"] - 0.5 * self.fwd_dxKM, Fwd["x"][-1] + 0.5 * self.fwd_dxKM
+            )
 
         assert Fwd["x"].ndim == Fwd["z"].ndim == 1
         Fwd["sx"] = Fwd["x"].size  # this is a vector
@@ -256,6 +311,9 @@ class Sim:
                 ]
             )
 
+        if self.fwd_xedges is not None:
+            EllCritParams.append(self.fwd_xedges)
+
         if self.raymap == "arbitrary":
             EllCritParams.extend(
                 [
@@ -286,3 +344,43 @@ def makexzgrid(xLim, zLim, dxKM, dzKM):
     else:
         zKM = None
     return xKM, zKM
+
+
+def makexedges(xLim, dxKM, fineLim, stretch, dxMaxKM):
+    """
+    nonuniform horizontal (B_perp) cell edges spanning xLim:
+    uniform dxKM cells over fineLim (e.g. the camera common volume or the arc),
+    outside of which each cell is stretch times wider than its neighbor, up to dxMaxKM.
+    """
+    assert stretch >= 1, "XstretchFactor must be >= 1"
+    fa = max(fineLim[0], xLim[0])
+    fb = min(fineLim[1], xLim[1])
+    assert fb > fa, "XfineKM must overlap XminKM,XmaxKM"
+
+    fine = fa + dxKM * arange(int((fb - fa) / dxKM + 1e-9) + 1)
+
+    right = stretchedges(fine[-1], xLim[1], dxKM, stretch, dxMaxKM)
+    left = -stretchedges(-fine[0], -xLim[0], dxKM, stretch, dxMaxKM)[::-1]
+
+    return np.concatenate((left, fine, right))
+
+
+def stretchedges(x0, xmax, dxKM, stretch, dxMaxKM):
+    """
+    cell edges beyond x0 up to and including xmax, with geometrically growing width.
+    A sliver cell at xmax is merged into its neighbor if that stays within dxMaxKM.
+    """
+    edges = []
+    x = x0
+    while x < xmax - 1e-6 * dxKM:
+        dxKM = min(dxKM * stretch, dxMaxKM)
+        x += dxKM
+        edges.append(x)
+
+    if edges:
+        edges[-1] = xmax
+        merged = xmax - (edges[-3] if len(edges) > 2 else x0)
+        if len(edges) > 1 and xmax - edges[-2] < 0.5 * dxKM and merged <= dxMaxKM:
+            del edges[-2]
+
+    return asarray(edges, dtype=float)
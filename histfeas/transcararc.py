@@ -7,25 +7,29 @@ from numpy import (
     pi,
     zeros,
     outer,
-    isnan,
-    log,
-    logspace,
     arange,
     allclose,
     diff,
     atleast_1d,
     isfinite,
+    add,
+    tensordot,
     repeat,
     append,
+    where,
+    searchsorted,
+    flatnonzero,
+    sqrt,
+    maximum,
+    minimum,
 )
 import h5py
 from scipy.interpolate import interp1d
+from scipy.special import erf
 import logging
-from xarray import DataArray
 
 #
 from gridaurora.eFluxGen import fluxgen
-from gridaurora.arcexcite import getTranscar
 from sciencedates import find_nearest
 
 
@@ -49,7 +53,11 @@ def getColumnVER(zgrid, zTranscar, Peig, Phi0):
 
 def getMp(sim, cam, zKM, makeplot):
     if set(("fwd", "optim")).isdisjoint(makeplot):
-        return {"Mp": None, "ztc": None, "Ek": None, "EKpcolor": None}
+        return {"Mp": None, "ztc": None, "Ek": None, "EKpcolor": None, "Ebin": None}
+    # only for the Transcar eigenprofiles: optical model and xarray
+    from xarray import DataArray
+    from gridaurora.arcexcite import getTranscar
+
     #%% read from transcar sim
     if cam[0].Bincl is None:
         raise ValueError(
@@ -68,38 +76,99 @@ def getMp(sim, cam, zKM, makeplot):
         Peig = asfortranarray(Peigen.values[goodAltInd, :])
     else:
         Peig = asfortranarray(Peigen.values)
-    #%% repack, with optional downsample
-    if sim.downsampleEnergy:
-        logging.warning("** downsampling in energy **")
-        Ek, EKpcolor, Peigen = downsampleEnergy(Ek, EKpcolor, Peig, sim.downsampleEnergy)
+    Mp = {"Mp": Peig, "ztc": zTranscar, "Ek": Ek, "EKpcolor": EKpcolor, "Ebin": None}
+    #%% optional flux-conserving energy rebinning
+    nEbin = energybincount(Ek.size, sim)
+    if nEbin < Ek.size:
+        logging.warning("** rebinning energy from {} to {} bins **".format(Ek.size, nEbin))
+        Ebin = energygroups(Ek.size, nEbin)
+        # keep the full grid for the synthetic flux, which is rebinned after it's built
+        Mp.update({"Ebin": Ebin, "MpFull": Peig, "EkFull": Ek, "EKpcolorFull": EKpcolor})
+        Mp["Ek"], Mp["EKpcolor"], Mp["Mp"] = rebinEnergy(Ek, EKpcolor, Peig, Ebin)
     # FIXME: just use a DataFrame!
-    return {"Mp": Peig, "ztc": zTranscar, "Ek": Ek, "EKpcolor": EKpcolor}
+    return Mp
 
 
-def downsampleEnergy(Ek, EKpcolor, Mp, downsamp):
-    """ we know original points are logspaced.
-    1) make new Ek2 axis, with 1/downsamp as many log-spaced points
-    2) fill new Phi0_downsamp values with sums of adjacent Ek bins
+def energybincount(nE, sim):
+    """
+    target number of energy bins, from .ini [transcar] nEnergyBins or legacy downsampleEnergy factor
     """
-    nEK = Ek.size // downsamp  # floor
+    if sim.nEnergyBins:
+        return min(sim.nEnergyBins, nE)
+    elif sim.downsampleEnergy and sim.downsampleEnergy > 1:
+        return max(int(nE // sim.downsampleEnergy), 1)
+    else:
+        return nE
 
-    Ek2 = logspace(log(Ek[0]), log(Ek[-1]), num=nEK, endpoint=True, base=exp(1))
-    EKpcolor2 = logspace(
-        log(EKpcolor[0]), log(EKpcolor[-1]), num=nEK + 1, endpoint=True, base=exp(1)
-    )
 
-    fp = interp1d(log(Ek), log(Mp), kind="linear", axis=1)
-    Mp2 = exp(fp(log(Ek2)))
-    if isnan(Mp2).any():
-        logging.warning("should these NaNs be set to zero?")
+def energygroups(nE, nbins):
+    """
+    first index of each group of adjacent energy bins, for numpy.add.reduceat()
+    The Transcar beams are log-spaced, so equal-count groups remain close to log-spaced.
+    """
+    nbins = min(max(int(nbins), 1), nE)
+    return (arange(nbins) * nE) // nbins
+
+
+def rebinEnergy(Ek, EKpcolor, Mp, Ebin):
+    """
+    flux-conserving energy rebinning, merging groups of adjacent beams that start at indices Ebin.
+
+    Mp columns are VER per unit diff. number flux of each beam, so summing the columns of a group
+    gives the same VER as the original beams under a flux that is flat across the group.
+    Ek is the lower edge of each bin and EKpcolor the Nenergy+1 bin edges, as from getBeamEnergies()
+    """
+    assert EKpcolor.size == Ek.size + 1, "EKpcolor must be the Nenergy+1 bin edges"
+
+    Ek2 = Ek[Ebin]
+    EKpcolor2 = append(EKpcolor[Ebin], EKpcolor[-1])
+    Mp2 = asfortranarray(add.reduceat(Mp, Ebin, axis=1))
+
     return Ek2, EKpcolor2, Mp2
 
 
-def getPhi0(sim, arc, xKM, Ek, makeplots):
+def rebinFlux(Phi, EKpcolor, Ebin):
+    """
+    Phi: Nenergy x ... differential number flux [cm^-2 s^-1 eV^-1] on the full grid with edges EKpcolor.
+    Returns the diff. number flux on the merged bins; the number flux in each merged bin is preserved.
+    """
+    dE = diff(EKpcolor)
+    dE2 = add.reduceat(dE, Ebin)
+    bshape = (-1,) + (1,) * (Phi.ndim - 1)
+
+    return asfortranarray(
+        add.reduceat(Phi * dE.reshape(bshape), Ebin, axis=0) / dE2.reshape(bshape)
+    )
+
+
+def rebinReport(EKpcolor, EKpcolor2, nx, verr=None):
+    """
+    speedup against resolution loss of the energy rebinning: the flux unknowns of each
+    FitVERopt fit (nEnergy x Nx), the worst-case relative bin width dE/E and,
+    for simulations, the relative error of the synthetic VER
+    """
+    nE, nE2 = EKpcolor.size - 1, EKpcolor2.size - 1
+    res = (diff(EKpcolor) / EKpcolor[:-1]).max()
+    res2 = (diff(EKpcolor2) / EKpcolor2[:-1]).max()
+
+    print(
+        "energy rebinning: {} -> {} bins, unknowns per fit {} -> {} ({:.1f}x fewer)"
+        "  worst dE/E: {:.2f} -> {:.2f}".format(nE, nE2, nE * nx, nE2 * nx, nE / nE2, res, res2)
+    )
+    if verr is not None:
+        print("energy rebinning: synthetic VER relative error {:.2e}".format(verr))
+
+
+def getPhi0(sim, arc, xKM, Mp, makeplots):
     #%% get flux
     Phi0 = None
+    Ebin = Mp.get("Ebin")
+    verr = None
 
     if not sim.realdata:
+        # the synthetic flux is built on the full energy grid, then rebinned like Mp
+        Ek = Mp["Ek"] if Ebin is None else Mp["EkFull"]
+
         if sim.Jfwdh5 is not None:
             print("Loading sim. input diff. number flux from {}".format(sim.Jfwdh5))
             with h5py.File(str(sim.Jfwdh5), "r", libver="latest") as f:
@@ -108,6 +177,21 @@ def getPhi0(sim, arc, xKM, Ek, makeplots):
             Phi0 = assemblePhi0(sim, arc, Ek, xKM)
         assert xKM.size == Phi0.shape[1]
 
+        if Ebin is not None and Phi0.shape[0] == Ek.size:
+            Phi0full = Phi0
+            Phi0 = rebinFlux(Phi0full, Mp["EKpcolorFull"], Ebin)
+            # resolution loss as seen by the forward model
+            verfull = tensordot(Mp["MpFull"], Phi0full, axes=1)
+            verr = abs(tensordot(Mp["Mp"], Phi0, axes=1) - verfull).sum() / abs(verfull).sum()
+        elif Ebin is not None:
+            logging.warning(
+                f"synthetic flux has {Phi0.shape[0]} energy bins, not the {Ek.size} of the "
+                "Transcar grid: not rebinned"
+            )
+
+    if Ebin is not None:
+        rebinReport(Mp["EKpcolorFull"], Mp["EKpcolor"], xKM.size, verr)
+
     return Phi0
 
 
@@ -125,23 +209,13 @@ def assemblePhi0(sim, arcs, Ek, xKM):
                 0
             ]  # Nenergy x Ntime
         elif a.zshape == "flat":
-            phiz = zeros((Ek.size, arc.tsim.size))  # zeros not empty or nan
-            for i, e in enumerate(arc.E0):
-                try:
-                    phiz[Ek <= e, i] = arc.Q0[i]  # Nenergy x Ntime_sim
-                except ValueError:
-                    pass
+            phiz = flatspectrum(Ek, arc.E0, arc.Q0)  # Nenergy x Ntime_sim
         elif a.zshape == "impulse":
-            phiz = zeros((Ek.size, arc.tsim.size))  # zeros not empty or nan
-            for i, e in enumerate(arc.E0):
-                try:
-                    phiz[find_nearest(Ek, e)[0], i] = arc.Q0[i]  # Nenergy x Ntime_sim
-                except ValueError:
-                    pass
+            phiz = impulsespectrum(Ek, arc.E0, arc.Q0)  # Nenergy x Ntime_sim
         else:
             raise NotImplementedError("unknown zshape = {}".format(a.zshape))
         #%% horizontal modulation
-        phix = getpx(xKM, arc.Wkm, arc.X0km, a.xshape)
+        phix = getpx(xKM, arc.Wkm, arc.X0km, a.xshape, sim.fwd_xedges)
 
         if a.zshape == "transcar":
             for i in range(sim.nTimeSlice):
@@ -154,14 +228,48 @@ def assemblePhi0(sim, arcs, Ek, xKM):
                 Phi0[..., i] += phi0sim
         elif a.zshape in ("impulse", "flat"):
             phix[~isfinite(phix)] = 0.0
-            for i in range(sim.nTimeSlice):
-                Phi0[..., i] += outer(phiz[:, i], phix[i, :])
+            nt = sim.nTimeSlice
+            # Nenergy x Nx x Ntime, all time steps at once
+            Phi0 += phiz[:, None, :nt] * phix[:nt, :].T[None, :, :]
         else:
             raise NotImplementedError
 
     return Phi0
 
 
+def flatspectrum(Ek, E0, Q0):
+    """
+    uniform number flux Q0 at and below E0, zero above (cutoff)
+    Ek: Nenergy, E0, Q0: Ntime --> Nenergy x Ntime
+
+    NaN E0 gives all zeros for that time
+    """
+    E0 = atleast_1d(E0)
+    Q0 = atleast_1d(Q0)
+
+    return where(Ek[:, None] <= E0[None, :], Q0[None, :], 0.0)
+
+
+def impulsespectrum(Ek, E0, Q0):
+    """
+    number flux Q0 in the single energy bin nearest E0
+    Ek: Nenergy (sorted ascending), E0, Q0: Ntime --> Nenergy x Ntime
+
+    ties go to the lower energy bin, like find_nearest(). NaN E0 gives all zeros for that time
+    """
+    E0 = atleast_1d(E0)
+    Q0 = atleast_1d(Q0)
+    phiz = zeros((Ek.size, E0.size))  # zeros not empty or nan
+
+    good = isfinite(E0)
+    i = searchsorted(Ek, E0[good]).clip(1, Ek.size - 1)
+    i -= (E0[good] - Ek[i - 1]) <= (Ek[i] - E0[good])  # step left when left neighbor is nearer
+
+    phiz[i, flatnonzero(good)] = Q0[good]
+
+    return phiz
+
+
 def upsampletime(arc, sim):
     #%% obtain observation time steps from spreadsheet (for now, equal to kinetic time)
     if abs(sim.kineticsec - diff(arc.texp).mean()) > 1e-3:
@@ -212,7 +320,12 @@ def upsampletime(arc, sim):
     return arc
 
 
-def getpx(xKM, Wkm, X0, xs):
+def getpx(xKM, Wkm, X0, xs, xp=None):
+    """
+    horizontal arc profile, Ntime x Nx
+    xp: optional Nx+1 cell edges of a nonuniform grid. The gaussian and rect profiles are then
+    averaged over each cell, so a narrow arc isn't missed by a wide cell.
+    """
     assert isinstance(xs, str)
     X0 = atleast_1d(X0)
     Wkm = atleast_1d(Wkm)
@@ -220,9 +333,18 @@ def getpx(xKM, Wkm, X0, xs):
         (X0.size, xKM.size), order="F"
     )  # since numpy 2-D array naturally iterates over rows
     #%%
-    if xs == "gaussian":
+    if xs == "gaussian" and xp is not None:
+        el = (xp[:-1] - X0[:, None]) / Wkm[:, None]
+        er = (xp[1:] - X0[:, None]) / Wkm[:, None]
+        px = 0.5 * sqrt(pi) * Wkm[:, None] * (erf(er) - erf(el)) / diff(xp)
+    elif xs == "gaussian":
         px = exp(-(((xKM - X0[:, None]) / Wkm[:, None]) ** 2))  # (original idea JLS)
     #%%
+    elif xs == "rect" and xp is not None:
+        # fraction of each cell covered by the rect. phantom
+        left = maximum(xp[:-1], (X0 - Wkm / 2)[:, None])
+        right = minimum(xp[1:], (X0 + Wkm / 2)[:, None])
+        px = (right - left).clip(0) / diff(xp)
     elif xs == "rect":
         # ir = xs=='rect'
         # for i in ir:
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+background writing of per-frame output (HDF5 results, PNG plots), so the inversion of
+frame t+1 overlaps with compression and disk writes of frame t.
+
+One writer thread works through a bounded queue in submission order.
+When the queue is full, submit() blocks until the writer catches up (back-pressure),
+so memory held by pending writes stays bounded.
+stop() -- also called at interpreter exit -- returns only after all pending writes are done.
+"""
+import logging
+import atexit
+from queue import Queue
+from threading import Thread
+from numpy import ndarray
+
+_writer = None
+
+
+class BackgroundWriter:
+    def __init__(self, maxsize):
+        self.q = Queue(maxsize=max(int(maxsize), 1))
+        self.thread = Thread(target=self.work, name="histfeas-writer", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args, **kwargs):
+        # copy arrays: the caller may reuse or modify them before the write happens
+        args = [a.copy() if isinstance(a, ndarray) else a for a in args]
+        kwargs = {k: v.copy() if isinstance(v, ndarray) else v for k, v in kwargs.items()}
+        self.q.put((func, args, kwargs))  # blocks when full
+
+    def work(self):
+        while True:
+            job = self.q.get()
+            try:
+                if job is None:
+                    return
+                func, args, kwargs = job
+                func(*args, **kwargs)
+            except Exception as e:
+                logging.error(f"background write {job[0].__name__} failed.  {e}")
+            finally:
+                self.q.task_done()
+
+    def flush(self):
+        self.q.join()
+
+    def stop(self):
+        self.q.put(None)
+        self.thread.join()
+
+
+def startwriter(maxsize):
+    """
+    maxsize: number of pending writes before submit() blocks. 0: write synchronously.
+    """
+    global _writer
+
+    stopwriter()
+    if not maxsize:
+        return
+
+    _writer = BackgroundWriter(maxsize)
+    atexit.register(stopwriter)
+
+    return _writer
+
+
+def stopwriter():
+    global _writer
+
+    if _writer is not None:
+        _writer.stop()
+        _writer = None
+
+
+def running():
+    return _writer is not None
+
+
+def flushwriter():
+    if _writer is not None:
+        _writer.flush()
+
+
+def submit(func, *args, **kwargs):
+    """
+    func(*args, **kwargs) in the writer thread if one is running, otherwise now
+    """
+    if _writer is None:
+        return func(*args, **kwargs)
+
+    _writer.submit(func, *args, **kwargs)
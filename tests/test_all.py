@@ -3,6 +3,8 @@
 Registration case for HiST program
 """
 from pathlib import Path
+from time import time
+import json
 from numpy.testing import assert_allclose
 import h5py
 
@@ -26,6 +28,90 @@ def readCheck(Phi0, Phifit, reffn):
         print(Emsg)
 
 
+def compareDtype(Phifit, Phifit32):
+    """
+    validation report of the single precision mode against the float64 registration result
+    """
+    for k, unit in (("gx0", "km"), ("gE0", "eV")):
+        v64, v32 = Phifit[0][k], Phifit32[0][k]
+        errpct = (v32 - v64) / v64 * 100
+        print("{} float64 {:.3f}  float32 {:.3f} [{}]  difference {:.2f} %".format(k, v64, v32, unit, errpct))
+        assert abs(errpct) < 5, "float32 {} differs from float64 beyond tolerance".format(k)
+
+
+def comparePeak(Phi0, Phifit, h5):
+    """
+    timing and accuracy of the fast peak estimator against the gaussian fit,
+    on the forward and estimated flux of the registration case
+    """
+    from histfeas.peakest import fastx0E0, gaussx0E0
+
+    with h5py.File(str(h5), "r", libver="latest") as f:
+        x = f["/pest/x"][()]
+    E = Phifit[0]["EK"]
+    phi = (Phi0[..., 0], Phifit[0]["x"])
+
+    tic = time()
+    gx0, gE0, _ = gaussx0E0(*phi, E, x, 0.0)
+    tgauss = time() - tic
+
+    tic = time()
+    fast = [fastx0E0(p, E, x, 0.0) for p in phi]
+    tfast = time() - tic
+
+    print("peak estimator time: gaussian {:.3f} s  fast {:.4f} s".format(tgauss, tfast))
+    for i, k in enumerate(("fwd", "fit")):
+        fx0, fE0 = fast[i]
+        print(
+            "{} (x0, E0) gaussian ({:.2f}, {:.0f})  fast ({:.2f}, {:.0f})".format(
+                k, gx0[i], gE0[i], fx0, fE0
+            )
+        )
+        assert abs(fx0 - gx0[i]) < 0.3, "fast x0 estimate differs from gaussian fit"
+        assert abs(fE0 - gE0[i]) / gE0[i] < 0.1, "fast E0 estimate differs from gaussian fit"
+
+
+def compareMultires(Phifit, PhifitMR, odir, odirMR):
+    """
+    fit time and (x0, E0) of the coarse-to-fine inversion against the single level inversion,
+    fit times from the profile.json of each run
+    """
+    tfit = []
+    for d in (odir, odirMR):
+        fn = Path(d) / "profile.json"
+        tfit.append(json.loads(fn.read_text())["totals"]["fit"]["wall"] if fn.is_file() else None)
+    if None not in tfit:
+        print("fit time: single level {:.1f} s  multires {:.1f} s".format(*tfit))
+
+    for k, unit in (("gx0", "km"), ("gE0", "eV")):
+        v1, vm = Phifit[0][k], PhifitMR[0][k]
+        errpct = (vm - v1) / v1 * 100
+        print("{} single level {:.3f}  multires {:.3f} [{}]  difference {:.2f} %".format(k, v1, vm, unit, errpct))
+        assert abs(errpct) < 10, "multires {} differs from single level beyond tolerance".format(k)
+
+
+def checkObsBatch():
+    """
+    real data, several frames: each column of the batch observation is the contiguous
+    vector getObs() gives for that frame
+    """
+    from types import SimpleNamespace
+    from numpy import arange
+    from histfeas.observeVolume import getObs, getObsBatch
+
+    npix, nframe = 32, 5
+    sim = SimpleNamespace(realdata=True, ncutpix=npix, nCamUsed=2)
+    keo = arange(npix * nframe, dtype=float).reshape(npix, nframe)
+    cam = [SimpleNamespace(usecam=True, keo=keo + k) for k in range(2)]
+    tInds = arange(1, nframe)
+
+    bnall = getObsBatch(sim, cam, tInds)
+    for j, ti in enumerate(tInds):
+        bn = bnall[:, j]
+        assert bn.flags["F_CONTIGUOUS"], "FitVER needs a contiguous observation vector"
+        assert_allclose(bn, getObs(sim, cam, None, ti, None))
+
+
 def writeout(regh5):
     with h5py.File(str(regh5), "a", libver="latest") as f:
         f["/phifwd/E0"] = 7500.0
@@ -53,4 +139,27 @@ if __name__ == "__main__":
     #%% check vs known result
     readCheck(Phi0, Phifit, "registration.h5")
     print("\nOK:  simulation registration case")
+    #%% fast peak estimator vs. gaussian fit
+    comparePeak(Phi0, Phifit, h5list[0])
+    print("\nOK:  fast peak estimator")
+    #%% single precision compute mode vs. float64
+    P32 = userinput(ini="registration.ini", outdir="out/reg32")
+    P32["overrides"]["dtype"] = "float32"
+    if not P32["load"]:
+        hist_figure(P32)
+    h5list32, P32 = findxlsh5(P32)
+    Phi032, Phifit32 = readresults(h5list32, P32)
+    compareDtype(Phifit, Phifit32)
+    print("\nOK:  float32 registration case")
+    #%% coarse-to-fine inversion vs. single level
+    PMR = userinput(ini="registration.ini", outdir="out/regmr")
+    PMR["overrides"]["multires"] = 3
+    if not PMR["load"]:
+        hist_figure(PMR)
+    h5listMR, PMR = findxlsh5(PMR)
+    Phi0MR, PhifitMR = readresults(h5listMR, PMR)
+    compareMultires(Phifit, PhifitMR, P["outdir"], PMR["outdir"])
+    print("\nOK:  multires registration case")
 #%% real data
+    checkObsBatch()
+    print("\nOK:  real data multi-frame observations")